@@ -1,40 +1,51 @@
-import multiprocessing
+import os
 import subprocess
+import sys
 import time
-
-# 仮想環境の Python パス
-python_path = "/Users/machidatatsuhiro/Desktop/ショートカット/python/myenv/bin/python"
-
-# レディーススクリプト（user-data-dir=/tmp/mercari_ladies_profile を使う必要あり）
-
-
-def run_script1():
-    print("🚀 レディースコメント投稿 実行開始")
-    subprocess.run(
-        [python_path, "/Users/machidatatsuhiro/Desktop/ショートカット/python/メルカリレディースコメント投稿実行.py"])
-
-# メンズスクリプト（user-data-dir=/tmp/mercari_mens_profile を使う必要あり）
-
-
-def run_script2():
-    print("⏳ メンズコメント投稿まで20秒待機...")
-    time.sleep(20)
-    print("🚀 メンズコメント投稿 実行開始")
-    subprocess.run(
-        [python_path, "/Users/machidatatsuhiro/Desktop/ショートカット/python/メルカリコメント投稿実行.py"])
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 実行中の Python をそのまま使う（仮想環境の固定パス不要）
+python_path = sys.executable
+REPO_ROOT = Path(__file__).resolve().parent
+SCRIPTS_DIR = REPO_ROOT / "scripts"
+
+# 各スクリプトは一時プロファイルを複製して使うので、同時起動してもプロファイルは衝突しない。
+# 起動をずらしたい場合だけ MERCARI_STAGGER_SEC（秒）を指定する。
+STAGGER_SEC = float(os.environ.get("MERCARI_STAGGER_SEC", "0"))
+
+# アカウントごとの Cookie（Actions と同じ ladies.json / men.json）。子プロセスには
+# MERCARI_COOKIES_PATH として個別に渡すので、両方が同じアカウントでログインすることはない。
+JOBS = [
+    ("レディースコメント投稿", "メルカリレディースコメント投稿.py", 0.0,
+     os.environ.get("MERCARI_COOKIES_LADIES_PATH", str(REPO_ROOT / "ladies.json"))),
+    ("メンズコメント投稿", "メルカリコメント投稿.py", STAGGER_SEC,
+     os.environ.get("MERCARI_COOKIES_MEN_PATH", str(REPO_ROOT / "men.json"))),
+]
+
+
+def run_script(label, script, delay, cookies_path):
+    if not Path(cookies_path).exists():
+        print(f"❌ {label}: Cookieファイルが存在しません: {cookies_path}")
+        return 1
+    if delay > 0:
+        print(f"⏳ {label}まで{delay:.0f}秒待機...")
+        time.sleep(delay)
+    print(f"🚀 {label} 実行開始")
+    start = time.perf_counter()
+    # 両スクリプトが同じマシンで並行するので、メモリ予算は JOBS 数で分け合う
+    env = dict(os.environ, MERCARI_COOKIES_PATH=cookies_path)
+    env.setdefault("MERCARI_MEM_PROCS", str(len(JOBS)))
+    result = subprocess.run([python_path, str(SCRIPTS_DIR / script)] + sys.argv[1:], env=env)
+    print(f"🕒 {label} 終了 {time.perf_counter() - start:.1f}s（exit={result.returncode}）")
+    return result.returncode
 
 
 if __name__ == "__main__":
-    # プロセス作成
-    p1 = multiprocessing.Process(target=run_script1)
-    p2 = multiprocessing.Process(target=run_script2)
-
-    # 並列に実行
-    p1.start()
-    p2.start()
-
-    # 終了待機
-    p1.join()
-    p2.join()
+    # 子プロセスの終了を待つだけなのでスレッドで十分（multiprocessing の fork は不要）
+    with ThreadPoolExecutor(max_workers=len(JOBS)) as pool:
+        codes = list(pool.map(lambda job: run_script(*job), JOBS))
 
     print("✅ 両方のスクリプトの実行が完了しました。")
+    # シグナルで落ちた子は負のコードになるので、0 以外が 1 つでもあれば失敗
+    sys.exit(0 if all(code == 0 for code in codes) else 1)
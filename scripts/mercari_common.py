@@ -0,0 +1,1148 @@
+# -*- coding: utf-8 -*-
+"""
+メルカリ系スクリプト共通ユーティリティ
+- 出品取得スクリプト／コメント投稿スクリプトの両方から import して使う
+- scripts/ 直下に置くので `python scripts/xxx.py` 実行時はそのまま import 可能
+"""
+
+import argparse
+import atexit
+import functools
+import hashlib
+import inspect
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+# gspread / jpholiday / requests は使う関数の中で import する（起動を軽くするため）
+
+
+# ====== 価格 ======
+PRICE_STEP = 100        # 値下げ幅（メルカリ100円値下げ）
+MIN_PRICE = 300         # メルカリの最低販売価格
+
+
+# ====== コメントテンプレート ======
+# コメント本文はテンプレートシートに 1 回だけ保存し、
+# コメント投稿シートの D 列にはテンプレートキー（または個別の上書き文面）だけを書く。
+TEMPLATE_HEADER = ["キー", "コメント"]
+TEMPLATE_WEEKDAY = "weekday"
+TEMPLATE_HOLIDAY = "holiday"
+
+_SALE_BODY = (
+    "こちらの商品ご検討頂き\nありがとうございます♫本日に限り\n"
+    "『ご希望の価格』を承ります！あまりに大幅な場合はお断りすることがございますが、"
+    "できる限りご要望お応えしたいと思います！\n"
+    "早い者勝ちになりますのでコメント\nにて金額ご提示ください(^^)\n"
+)
+
+DEFAULT_TEMPLATES = {
+    TEMPLATE_WEEKDAY: "☆★本日限定SALE★☆\n" + _SALE_BODY,
+    TEMPLATE_HOLIDAY: "☆★土日祝限定SALE★☆\n" + _SALE_BODY,
+}
+
+
+def template_key_for(day=None):
+    """土日祝なら holiday、それ以外は weekday"""
+    import jpholiday
+
+    day = day or datetime.now()
+    if day.weekday() >= 5 or jpholiday.is_holiday(day):
+        return TEMPLATE_HOLIDAY
+    return TEMPLATE_WEEKDAY
+
+
+def template_rows(templates=None):
+    templates = templates or DEFAULT_TEMPLATES
+    return [[key, text] for key, text in templates.items()]
+
+
+# 英数字だけの短い値はテンプレートキーとみなす（未登録なら上書き文面として投稿しない）
+_TEMPLATE_KEY_RE = re.compile(r"[A-Za-z][A-Za-z0-9_-]{0,31}")
+
+
+def parse_templates(values):
+    """テンプレートシートの値（ヘッダー込み）→ {キー: 本文}（シートに無いキーは既定の文面）"""
+    templates = {}
+    for row in values[1:]:
+        if len(row) >= 2 and row[0].strip() and row[1].strip():
+            templates[row[0].strip()] = row[1]
+    return {**DEFAULT_TEMPLATES, **templates}
+
+
+def load_templates(spreadsheet, sheet_name):
+    """テンプレートシートを読んで {キー: 本文} を返す（シートが無ければ既定の文面）"""
+    import gspread
+
+    try:
+        ws = with_retry("worksheet", spreadsheet.worksheet, sheet_name)
+        return parse_templates(with_retry("get_all_values", ws.get_all_values))
+    except gspread.exceptions.WorksheetNotFound:
+        print("⏭️ テンプレートシートが無いため既定の文面を使用:", sheet_name)
+        return dict(DEFAULT_TEMPLATES)
+
+
+def render_comment(cell, templates, name="", price=""):
+    """
+    D 列の値をコメント本文に展開する。
+    - テンプレートキーならテンプレート本文
+    - キーの形なのに未登録なら ValueError（キー文字列をそのまま投稿しない）
+    - それ以外は個別の上書き文面としてそのまま使う
+    本文中の {商品名} / {価格} は行ごとの値に置換する。
+    """
+    cell = cell or ""
+    key = cell.strip()
+    if key in templates:
+        text = templates[key]
+    elif _TEMPLATE_KEY_RE.fullmatch(key):
+        raise ValueError(f"未登録のテンプレートキー: {key}")
+    else:
+        text = cell
+    return text.replace("{商品名}", name).replace("{価格}", price)
+
+
+# ====== 計測 ======
+class PhaseTimer:
+    """行ごとの処理フェーズ（入力・送信など）の所要時間を積算する"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, other):
+        for name, sec in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + sec
+
+    def summary(self):
+        return " ".join(f"{name}={sec:.2f}s" for name, sec in self.phases.items())
+
+
+# ====== 起動時間 ======
+# Google 認証・open_by_url は Chrome 起動やスクレイピングと並行してバックグラウンドで始め、
+# 必要になった時点で Future.result() で受け取る。
+def start_background(label, fn, *args, **kwargs):
+    """fn(*args, **kwargs) を別スレッドで開始して Future を返す"""
+    def run():
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            print(f"🕒 {label} {time.perf_counter() - start:.2f}s（バックグラウンド）")
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bg")
+    future = pool.submit(run)
+    pool.shutdown(wait=False)
+    return future
+
+
+def process_uptime():
+    """プロセス開始からの経過秒（/proc が無い環境では None）"""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def startup_timer():
+    """起動フェーズ計測用の PhaseTimer（import = プロセス開始から main 到達までを記録済み）"""
+    timer = PhaseTimer()
+    uptime = process_uptime()
+    if uptime is not None:
+        timer.phases["import"] = uptime
+    return timer
+
+
+# ====== テキスト入力 ======
+# send_keys は 1 文字ごとにキーイベントになるので、長文コメントは
+# CDP の Input.insertText で一括挿入する。
+_SET_VALUE_JS = """
+const el = arguments[0], text = arguments[1];
+const proto = el.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+Object.getOwnPropertyDescriptor(proto, 'value').set.call(el, text);
+el.dispatchEvent(new Event('input', {bubbles: true}));
+el.dispatchEvent(new Event('change', {bubbles: true}));
+"""
+
+
+def _value_matches(el, text):
+    value = (el.get_attribute("value") or "").replace("\r\n", "\n")
+    return value == text.replace("\r\n", "\n")
+
+
+def insert_text(driver, el, text):
+    """
+    el にフォーカスして text を入力し、使った方式（cdp / setter / send_keys）を返す。
+    1. CDP Input.insertText（実入力と同じ経路なのでフレームワークも拾う）
+    2. ネイティブ setter + input イベント
+    3. 最後の手段として send_keys
+    """
+    driver.execute_script("arguments[0].focus();", el)
+    try:
+        driver.execute_cdp_cmd("Input.insertText", {"text": text})
+        if _value_matches(el, text):
+            return "cdp"
+    except Exception as e:
+        print(f"⚠️ CDP入力失敗: {e}")
+    try:
+        driver.execute_script(_SET_VALUE_JS, el, text)
+        if _value_matches(el, text):
+            return "setter"
+    except Exception as e:
+        print(f"⚠️ setter入力失敗: {e}")
+    try:
+        el.clear()
+    except Exception:
+        pass
+    el.send_keys(text)
+    return "send_keys"
+
+
+# ====== 出品一覧の逐次取得 ======
+# 大量出品のプロフィールでは全カードを描画し続けると Chrome のレイアウトコストが
+# 膨らむので、読み込まれた分だけ 1 回のスクリプト呼び出しで抽出 → 処理済みカードは
+# display:none にしてレイアウト対象から外す（ノード自体は React が管理しているので残す）。
+_HARVEST_CARDS_JS = """
+const hide = arguments[0];
+const items = [];
+for (const a of document.querySelectorAll('a[href*="/item/"]:not([data-mc-done])')) {
+  const name = a.querySelector('span[data-testid="thumbnail-item-name"]');
+  const price = a.querySelector('span[class*="number__"]');
+  if (!name || !price) continue;  // 描画途中のカードは次のラウンドで拾う
+  a.setAttribute('data-mc-done', '1');
+  items.push([name.textContent.trim(), price.textContent.trim(), a.href]);
+  // remove() すると「もっと見る」後の React の再描画で NotFoundError になり描画が止まる
+  if (hide) (a.closest('li') || a).style.display = 'none';
+}
+const more = [...document.querySelectorAll('button')].find(b => b.textContent.trim() === 'もっと見る');
+if (more) more.click();
+window.scrollTo(0, document.body.scrollHeight);
+return {items: items, more: !!more};
+"""
+
+
+def collect_items_incremental(driver, hide=True, idle_rounds=5, pause=1.5):
+    """
+    「もっと見る」クリック／スクロールのたびに新規カードだけを抽出する。
+    URL で重複排除し、idle_rounds 回連続で新規が無ければ終了。
+    戻り値は [商品名, 価格, URL] のリスト。
+    """
+    item_data = []
+    seen = set()
+    idle = idle_rounds
+    page = 0
+    while idle > 0:
+        page += 1
+        start = time.perf_counter()
+        result = driver.execute_script(_HARVEST_CARDS_JS, hide)
+        added = 0
+        for name, price, url in result["items"]:
+            if not url or url in seen or not name or not price:
+                continue
+            seen.add(url)
+            item_data.append([name, price, url])
+            added += 1
+        print(f"📦 page {page}: +{added}件（累計 {len(item_data)}件） {time.perf_counter() - start:.2f}s")
+        idle = idle_rounds if added else idle - 1
+        time.sleep(pause)
+    return item_data
+
+
+# ====== 商品ページの状態スナップショット ======
+# 投稿ループが必要とする情報（コメント件数・「もっと見る」・入力欄・送信ボタン・
+# ログイン状態・売り切れ／削除）を 1 回のスクリプト呼び出しでまとめて取得する。
+# 要素は WebElement のまま返るので、そのままクリックや入力に使える。
+SOLD_OUT_MARKERS = ["売り切れました"]
+DELETED_MARKERS = ["該当する商品は削除されています", "この商品は削除されました", "ページが見つかりません"]
+POSTED_MARKERS = ["コメントを送信", "コメントを投稿"]
+
+_PAGE_STATE_JS = """
+const [soldMarkers, deletedMarkers, postedMarkers] = arguments;
+const text = el => (el.innerText || el.textContent || '').replace(/\\s+/g, ' ').trim();
+const usable = el => !el.disabled && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+const first = selectors => {
+  for (const sel of selectors) {
+    const el = [...document.querySelectorAll(sel)].find(usable);
+    if (el) return el;
+  }
+  return null;
+};
+const body = document.body ? document.body.innerText : '';
+const buttons = [...document.querySelectorAll('button')];
+const submits = buttons.filter(b => b.type === 'submit' && usable(b));
+const comments = document.querySelectorAll("[data-testid='comment'], [class*='CommentItem'], [class*='comment']");
+const areas = [...document.querySelectorAll('textarea')];
+const deleted = deletedMarkers.some(m => body.includes(m));
+return {
+  ready: deleted || !!document.querySelector('h1, #item-info textarea'),
+  comments: comments.length,
+  last_comment: comments.length ? text(comments[comments.length - 1]) : '',
+  expand: buttons.find(b => text(b) === 'コメントをもっと見る' && usable(b)) || null,
+  textarea: first(['#item-info textarea', 'form textarea', 'textarea:not([disabled])',
+                   "textarea[placeholder*='コメント']", "textarea[aria-label*='コメント']"]),
+  submit: submits.find(b => b.closest('form') && text(b).includes('コメントを送信'))
+       || submits.find(b => text(b).includes('コメント'))
+       || submits.find(b => b.closest('form')) || null,
+  textareas_empty: areas.length > 0 && areas.every(a => !(a.value || '').trim()),
+  posted_marker: postedMarkers.some(m => body.includes(m)),
+  logged_in: !document.querySelector("a[href*='/signin'], a[href*='/login']"),
+  sold_out: buttons.some(b => soldMarkers.some(m => text(b).includes(m))),
+  deleted: deleted,
+};
+"""
+
+
+def page_state(driver):
+    """商品ページの状態を dict で返す（キーは _PAGE_STATE_JS の return を参照）"""
+    return driver.execute_script(_PAGE_STATE_JS, SOLD_OUT_MARKERS, DELETED_MARKERS, POSTED_MARKERS)
+
+
+def unavailable_reason(state):
+    """売り切れ・削除済みならスキップ理由、それ以外は空文字"""
+    if state["deleted"]:
+        return "削除済み"
+    if state["sold_out"]:
+        return "売り切れ"
+    return ""
+
+
+# ====== メモリ監視（Chrome プロセスツリーの RSS）======
+# ubuntu-latest ランナーは RAM が限られるので、ドライバ配下の Chrome 全プロセスの
+# RSS を /proc から集計し、予算内に収まるワーカー数を決める（/proc が無い環境では 0 扱い）。
+def _parent_map():
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+            parents[int(entry)] = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return parents
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree_rss(root_pid):
+    """root_pid とその子孫プロセスの RSS 合計（bytes）"""
+    if not os.path.isdir("/proc"):
+        return 0
+    children = {}
+    for pid, ppid in _parent_map().items():
+        children.setdefault(ppid, []).append(pid)
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += _rss_bytes(pid)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def driver_rss(driver):
+    """chromedriver プロセス配下（Chrome 本体・レンダラ含む）の RSS 合計"""
+    try:
+        return process_tree_rss(driver.service.process.pid)
+    except Exception:
+        return 0
+
+
+def _mem_available_bytes():
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class MemoryController:
+    """
+    ブラウザワーカーの同時実行数をメモリ予算から決める。
+    - 予算: MERCARI_MEM_BUDGET_MB（未指定なら生成時 MemAvailable の 70% を MERCARI_MEM_PROCS で等分）
+      → Chrome 起動前に生成すること
+    - 1 ワーカーの見積もり: 観測したピーク RSS（未観測なら per_worker_mb）
+    - 予算超過／空きメモリ不足で under_pressure() が True
+    - should_restart() は再起動の間隔を空ける（圧迫が続くなら間隔を倍にしていく）
+    """
+
+    MB = 1024 * 1024
+
+    def __init__(self, per_worker_mb=700, max_workers=4, low_free_mb=300, cooldown=120.0, max_cooldown=1800.0):
+        budget_mb = os.environ.get("MERCARI_MEM_BUDGET_MB")
+        if budget_mb:
+            self.budget = int(budget_mb) * self.MB
+        else:
+            # 同じマシンで並行実行するプロセス数（MercariCommen.py が設定）で予算を分け合う
+            procs = max(1, int(os.environ.get("MERCARI_MEM_PROCS", "1")))
+            self.budget = int(_mem_available_bytes() * 0.7 / procs) or 2048 * self.MB
+        self.per_worker = per_worker_mb * self.MB
+        self.max_workers = max_workers
+        self.low_free = low_free_mb * self.MB
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.next_restart = 0.0
+        self.restarts = 0
+        self.current = {}
+        self.peaks = {}
+
+    def sample(self, name, driver):
+        rss = driver_rss(driver)
+        self.current[name] = rss
+        self.peaks[name] = max(self.peaks.get(name, 0), rss)
+        return rss
+
+    def forget(self, name):
+        self.current.pop(name, None)
+
+    def worker_count(self):
+        estimate = max([self.per_worker] + list(self.peaks.values()))
+        return max(1, min(self.max_workers, self.budget // estimate))
+
+    def under_pressure(self):
+        free = _mem_available_bytes()
+        if free and free < self.low_free:
+            return True
+        return sum(self.current.values()) > self.budget
+
+    def should_restart(self, name=None):
+        """
+        圧迫中かつ前回の再起動からクールダウンが過ぎていれば True（name 指定時は最も重いワーカーのみ）。
+        Chrome 以外が原因で空きが戻らない場合に毎行再起動しないよう、続けて発動するたびに間隔を倍にする。
+        """
+        if not self.under_pressure():
+            self.cooldown = self.base_cooldown
+            return False
+        if name is not None and self.heaviest() != name:
+            return False
+        now = time.monotonic()
+        if now < self.next_restart:
+            return False
+        self.next_restart = now + self.cooldown
+        self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+        self.restarts += 1
+        return True
+
+    def heaviest(self):
+        return max(self.current, key=self.current.get) if self.current else None
+
+    def report(self):
+        print(
+            f"🧠 メモリ予算: {self.budget / self.MB:.0f}MB / 推奨ワーカー数: {self.worker_count()} / "
+            f"メモリ起因の再起動: {self.restarts}回"
+        )
+        for name, peak in sorted(self.peaks.items()):
+            print(f"🧠 {name}: ピークRSS {peak / self.MB:.0f}MB")
+
+
+# ====== リトライ／サーキットブレーカー ======
+# Google API 呼び出しは 429 / 5xx / 通信エラーを指数バックオフ（フルジッター）で再試行。
+# メルカリのページ読み込みはホスト単位のサーキットブレーカーで、規制中は行を消費せずキューを止める。
+RETRY_STATS = {}
+
+
+def _count(label):
+    RETRY_STATS[label] = RETRY_STATS.get(label, 0) + 1
+
+
+def _is_retryable(exc):
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # 通信・タイムアウトだけ再試行（FileNotFoundError / PermissionError などの OSError は即失敗）
+    return isinstance(exc, (ConnectionError, TimeoutError, RequestsConnectionError, Timeout))
+
+
+def with_retry(label, fn, *args, attempts=5, base_delay=1.0, max_delay=60.0, **kwargs):
+    """fn(*args, **kwargs) をリトライ付きで実行する（label はサマリー表示用）"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts or not _is_retryable(e):
+                raise
+            _count(label)
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            print(f"🔁 {label} リトライ {attempt}/{attempts - 1}: {e} → {delay:.1f}秒待機")
+            time.sleep(delay)
+
+
+# 商品ページのタイトルには商品名（型番の "429" など）が入るので、タイトルはエラーページと完全一致で判定する
+THROTTLE_TITLES = {"429", "429 Too Many Requests", "Too Many Requests"}
+THROTTLE_MARKERS = ["アクセスが集中", "しばらく時間をおいて"]
+
+
+class Throttled(Exception):
+    """規制が max_wait を超えて続いた（行を失敗にせず実行を中断する）"""
+
+
+def is_throttled(driver):
+    try:
+        title = (driver.title or "").strip()
+        body = driver.execute_script("return document.body ? document.body.innerText.slice(0, 2000) : '';") or ""
+    except Exception:
+        return False
+    return title in THROTTLE_TITLES or any(m in body for m in THROTTLE_MARKERS)
+
+
+class CircuitBreaker:
+    """
+    ホスト単位のサーキットブレーカー。
+    - 連続 threshold 回の読み込み失敗、または規制ページ検出でオープン
+    - オープン中は before() がクールダウン終了まで待機（キューを一時停止）
+    - 再オープンのたびにクールダウンを倍（max_cooldown まで）
+    """
+
+    def __init__(self, threshold=3, cooldown=60.0, max_cooldown=900.0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = {}
+        self.cooldowns = {}
+        self.open_until = {}
+
+    def before(self, url):
+        host = urlparse(url).netloc
+        wait = self.open_until.get(host, 0) - time.time()
+        if wait > 0:
+            _count(f"pause:{host}")
+            print(f"⛔ {host} 規制中のため {wait:.0f}秒 キュー停止")
+            time.sleep(wait)
+
+    def success(self, url):
+        host = urlparse(url).netloc
+        self.failures[host] = 0
+        self.cooldowns.pop(host, None)
+
+    def failure(self, url, throttled=False):
+        host = urlparse(url).netloc
+        self.failures[host] = self.failures.get(host, 0) + 1
+        if throttled or self.failures[host] >= self.threshold:
+            cooldown = self.cooldowns.get(host, self.base_cooldown)
+            self.open_until[host] = time.time() + cooldown
+            self.cooldowns[host] = min(self.max_cooldown, cooldown * 2)
+            self.failures[host] = 0
+            _count(f"breaker:{host}")
+            print(f"⛔ {host} サーキットオープン（{cooldown:.0f}秒）")
+
+
+def load_page(driver, url, breaker, ready=None, max_wait=1800.0):
+    """
+    url を開き ready(driver) で読み込み完了を確認する。
+    規制ページなら失敗扱いにせずブレーカーで待機して再読み込み（合計 max_wait 秒まで、超えたら Throttled）。
+    通常の読み込み失敗は False（呼び出し側で失敗として記録）。
+    """
+    start = time.monotonic()
+    while True:
+        breaker.before(url)
+        try:
+            driver.get(url)
+            loaded = ready(driver) if ready else True
+        except Exception as e:
+            if type(e).__name__ != "TimeoutException":
+                raise
+            loaded = False
+        throttled = is_throttled(driver)
+        if loaded and not throttled:
+            breaker.success(url)
+            return True
+        breaker.failure(url, throttled=throttled)
+        if not throttled:
+            return False
+        _count("page_load")
+        if time.monotonic() - start > max_wait:
+            raise Throttled(f"{urlparse(url).netloc} の規制が {max_wait:.0f}秒以上続いています")
+
+
+def rate_per_min():
+    """MERCARI_RATE_PER_MIN（件/分）。未指定なら None、0 以下や数値でなければ ValueError"""
+    text = os.environ.get("MERCARI_RATE_PER_MIN")
+    if not text:
+        return None
+    try:
+        rate = float(text)
+    except ValueError:
+        rate = 0.0
+    if not rate > 0:
+        raise ValueError(f"MERCARI_RATE_PER_MIN は 0 より大きい数で指定: {text!r}")
+    return rate
+
+
+class RateLimiter:
+    """
+    送信（コメント投稿・価格変更）の間隔を全ワーカー共通で空ける。
+    既定はコメント投稿のクールダウンと同じ 2.5〜4.0 秒。
+    """
+
+    def __init__(self, interval=(2.5, 4.0)):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    @classmethod
+    def for_shard(cls, shard):
+        """
+        アカウント全体の送信レート予算をシャード数で割った間隔にする。
+        予算は MERCARI_RATE_PER_MIN（件/分）、未指定なら 1 ランナーと同じ 2.5〜4.0 秒間隔相当。
+        """
+        count = shard[1]
+        rate = rate_per_min()
+        if rate:
+            mean = 60.0 / rate
+            low, high = mean * 0.8, mean * 1.2
+        else:
+            low, high = 2.5, 4.0
+        return cls((low * count, high * count))
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + random.uniform(*self.interval)
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def print_retry_summary():
+    if not RETRY_STATS:
+        print("🔁 リトライ集計: なし")
+        return
+    print("🔁 リトライ集計: " + ", ".join(f"{k}={v}" for k, v in sorted(RETRY_STATS.items())))
+
+
+# ====== 実行オプション（dry-run / replay / shard）======
+def run_arg_parser(replay=True):
+    """
+    共通オプションのパーサー（スクリプト固有の引数は add_argument で追加）。
+    replay 再生に対応していないスクリプトは replay=False で --replay を付けない。
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dry-run", action="store_true", default=os.environ.get("MERCARI_DRY_RUN") == "1",
+        help="送信ボタンのクリック以外をすべて実行する（MERCARI_DRY_RUN=1 でも可）",
+    )
+    if replay:
+        parser.add_argument(
+            "--replay", default=os.environ.get("MERCARI_REPLAY"),
+            help="保存済み HTML のディレクトリ（debug/ など）または行データ JSON から再生する（常に dry-run）",
+        )
+    parser.add_argument(
+        # 文字列の既定値にも type が適用されるので、不正な MERCARI_SHARD も usage エラーになる
+        "--shard", type=parse_shard, default=os.environ.get("MERCARI_SHARD", "1/1"),
+        help="i/N（1 始まり）で行を商品 ID のハッシュで N 分割し i 番目だけ処理する（MERCARI_SHARD でも可）",
+    )
+    return parser
+
+
+def parse_run_args(argv=None, parser=None):
+    parser = parser or run_arg_parser()
+    args = parser.parse_args(argv)
+    try:
+        rate_per_min()
+    except ValueError as e:
+        parser.error(str(e))
+    if getattr(args, "replay", None):
+        # replay はシート・ログイン・ネットワーク不要（送信もテンプレートのウォームアップもしない）
+        args.dry_run = True
+        skip_profile_warmup()
+    return args
+
+
+def parse_shard(text):
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text or "")
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError(f"shard は i/N（1 ≦ i ≦ N）で指定: {text!r}")
+    return int(m.group(1)), int(m.group(2))
+
+
+def shard_label(shard):
+    return "" if shard[1] == 1 else f" {shard[0]}/{shard[1]}"
+
+
+def in_shard(url, shard):
+    """
+    商品 ID（/item/mXXX・/sell/edit/mXXX の末尾）の安定ハッシュで振り分ける。
+    コメント投稿と値下げで同じ商品は同じシャードに入る。
+    """
+    index, count = shard
+    if count == 1:
+        return True
+    key = (url or "").split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % count == index - 1
+
+
+def load_replay_rows(path):
+    """
+    再生用の行データ（ヘッダー無し、[商品名, 価格, URL, コメント]）を返す。
+    - ディレクトリ: 中の *.html を file:// URL の行にする（コメントは weekday テンプレート）
+    - JSON ファイル: シートの行をそのまま記録した配列
+    """
+    path = Path(path)
+    if path.is_dir():
+        return [["", "", p.resolve().as_uri(), TEMPLATE_WEEKDAY] for p in sorted(path.glob("*.html"))]
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ====== 実行結果の一括書き込み ======
+# 行ごとの結果（ステータス・理由・日時・反映秒）はメモリに溜めて、終了時に
+# batch_update 1 回で書き戻す。実行サマリーは RUN_LOG_SHEET に 1 行追記。
+RESULT_HEADER = ["ステータス", "理由", "日時", "反映秒"]
+RUN_LOG_SHEET = "投稿実行ログ"
+# 未確認・スキップは後から足した列なので、既存のログと列がずれないよう末尾に置く
+RUN_LOG_HEADER = ["開始", "終了", "スクリプト", "処理", "完了", "失敗", "未確認", "スキップ"]
+STATUS_DONE = "完了"
+STATUS_FAIL = "失敗"
+STATUS_DRY_RUN = "dry-run"
+STATUS_SKIP = "スキップ"
+STATUS_UNVERIFIED = "未確認"  # 送信したが反映を確認していない（再実行時は対象に残る）
+
+
+def _a1(row, col):
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return f"{letters}{row}"
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ResultWriter:
+    """worksheet が None（dry-run / replay）のときは集計の表示だけ行う"""
+
+    def __init__(self, worksheet, status_col, label):
+        self.worksheet = worksheet
+        self.status_col = status_col
+        self.label = label
+        self.started = _now()
+        self.rows = {}
+
+    def record(self, sheet_row, status, reason="", latency=None):
+        latency = f"{latency:.2f}" if latency is not None else ""
+        self.rows[sheet_row] = [status, reason, _now(), latency]
+
+    def counts(self):
+        counts = {}
+        for status, *_ in self.rows.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def _ranges(self):
+        """連続する行はまとめて 1 レンジにする"""
+        last_col = self.status_col + len(RESULT_HEADER) - 1
+        ranges = [{
+            "range": f"{_a1(1, self.status_col)}:{_a1(1, last_col)}",
+            "values": [RESULT_HEADER],
+        }]
+        block = []
+        for row in sorted(self.rows) + [None]:
+            if block and (row is None or row != block[-1] + 1):
+                ranges.append({
+                    "range": f"{_a1(block[0], self.status_col)}:{_a1(block[-1], last_col)}",
+                    "values": [self.rows[r] for r in block],
+                })
+                block = []
+            if row is not None:
+                block.append(row)
+        return ranges
+
+    def flush(self):
+        counts = self.counts()
+        print(f"📊 結果: 処理 {len(self.rows)}件 / " + ", ".join(f"{k} {v}件" for k, v in counts.items()))
+        if self.worksheet is None or not self.rows:
+            return
+        try:
+            with_retry("batch_update", self.worksheet.batch_update, self._ranges())
+            print(f"📝 結果書き込み完了: {len(self.rows)}行")
+        except Exception as e:
+            print(f"⚠️ 結果書き込み失敗: {e}")
+
+    def write_summary(self):
+        if self.worksheet is None:
+            return
+        counts = self.counts()
+        row = [
+            self.started, _now(), self.label, len(self.rows),
+            counts.get(STATUS_DONE, 0), counts.get(STATUS_FAIL, 0),
+            counts.get(STATUS_UNVERIFIED, 0), counts.get(STATUS_SKIP, 0),
+        ]
+        import gspread
+
+        spreadsheet = self.worksheet.spreadsheet
+        try:
+            try:
+                log = with_retry("worksheet", spreadsheet.worksheet, RUN_LOG_SHEET)
+            except gspread.exceptions.WorksheetNotFound:
+                try:
+                    log = with_retry(
+                        "add_worksheet", spreadsheet.add_worksheet, title=RUN_LOG_SHEET, rows="1000", cols="10",
+                    )
+                except gspread.exceptions.APIError:
+                    # 別シャードが同時に作成済み
+                    log = with_retry("worksheet", spreadsheet.worksheet, RUN_LOG_SHEET)
+            # ヘッダーは A1 に上書き（新規シート・旧ヘッダーのどちらでも同じ結果になる）
+            if with_retry("row_values", log.row_values, 1) != RUN_LOG_HEADER:
+                with_retry("batch_update", log.batch_update, [{"range": "A1", "values": [RUN_LOG_HEADER]}])
+            # append_row は再試行すると行が重複しうるので 1 回だけ
+            log.append_row(row)
+        except Exception as e:
+            print(f"⚠️ 実行サマリー書き込み失敗: {e}")
+
+
+# ====== Chrome プロファイルテンプレート ======
+# 空の一時プロファイルだと HTTP キャッシュ・JS コードキャッシュ・初回起動処理が毎回コールドになる。
+# 1 度だけウォームアップしたテンプレートを作り、各ドライバはそれを複製して使う。
+# （ワークフローの rm -rf /tmp/mercari_profile_* に消されないよう名前を分けている）
+PROFILE_TEMPLATE_DIR = Path(
+    os.environ.get("MERCARI_PROFILE_TEMPLATE", os.path.join(tempfile.gettempdir(), "mercari_template_profile"))
+)
+PROFILE_WARMUP_URLS = ["https://jp.mercari.com/"]
+_PROFILE_READY = ".mercari_warm"
+_PROFILE_LOCKS = ("SingletonLock", "SingletonCookie", "SingletonSocket", "lockfile")
+
+
+_warmup_allowed = True
+
+
+def _profile_enabled():
+    return os.environ.get("MERCARI_WARM_PROFILE", "1") != "0"
+
+
+def skip_profile_warmup():
+    """テンプレートを新規作成しない（replay などネットワーク不要の実行用。既存テンプレートの複製は可）"""
+    global _warmup_allowed
+    _warmup_allowed = False
+
+
+def ensure_profile_template(build_driver):
+    """
+    テンプレートが無ければ build_driver(profile_dir) で Chrome を起動してウォームアップする。
+    使えるテンプレートがあれば True。
+    """
+    if not _profile_enabled():
+        return False
+    if (PROFILE_TEMPLATE_DIR / _PROFILE_READY).exists():
+        return True
+    if not _warmup_allowed:
+        return False
+    building = PROFILE_TEMPLATE_DIR.with_name(PROFILE_TEMPLATE_DIR.name + f".building{os.getpid()}")
+    shutil.rmtree(building, ignore_errors=True)
+    start = time.perf_counter()
+    try:
+        driver = build_driver(str(building))
+        try:
+            for url in PROFILE_WARMUP_URLS:
+                driver.get(url)
+                time.sleep(2)
+        finally:
+            driver.quit()
+        (building / _PROFILE_READY).touch()
+        building.rename(PROFILE_TEMPLATE_DIR)
+    except Exception as e:
+        print(f"⚠️ プロファイルテンプレート作成失敗（コールド起動で続行）: {e}")
+        shutil.rmtree(building, ignore_errors=True)
+        return (PROFILE_TEMPLATE_DIR / _PROFILE_READY).exists()
+    print(f"🔥 プロファイルテンプレート作成: {PROFILE_TEMPLATE_DIR} {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def clone_profile(prefix="mercari_profile_"):
+    """
+    一時プロファイルを作って (パス, ウォーム済みか) を返す。
+    cp --reflink=auto で CoW 対応 FS なら実質コピー無し、それ以外は通常コピー。
+    ハードリンクは Chrome がキャッシュ索引をその場で書き換えてテンプレートを汚すので使わない。
+    """
+    dest = tempfile.mkdtemp(prefix=prefix)
+    if not _profile_enabled() or not (PROFILE_TEMPLATE_DIR / _PROFILE_READY).exists():
+        return dest, False
+    try:
+        subprocess.run(
+            ["cp", "-a", "--reflink=auto", f"{PROFILE_TEMPLATE_DIR}/.", dest],
+            check=True, capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        shutil.copytree(
+            PROFILE_TEMPLATE_DIR, dest, dirs_exist_ok=True, symlinks=True,
+            ignore=shutil.ignore_patterns(*_PROFILE_LOCKS),
+        )
+    for name in _PROFILE_LOCKS:
+        for lock in Path(dest).rglob(name):
+            lock.unlink(missing_ok=True)
+    return dest, True
+
+
+def driver_profile(profile_dir=None, build_driver=None):
+    """
+    create_driver 用の (プロファイルパス, ウォーム済みか) を返す。
+    - profile_dir 指定時（テンプレート作成用）はそのまま使い、削除しない
+    - それ以外はテンプレートを複製した一時プロファイル（終了時に削除）
+    build_driver を渡すと、テンプレートが無ければ先に作る。
+    """
+    if profile_dir:
+        return profile_dir, False
+    if build_driver:
+        ensure_profile_template(build_driver)
+    dest, warm = clone_profile()
+    atexit.register(shutil.rmtree, dest, ignore_errors=True)
+    return dest, warm
+
+
+def launch_chrome(chrome_options, warm):
+    """Chrome を起動して起動時間を表示する（timed_get 用に profile_warm を付ける）"""
+    from selenium import webdriver
+
+    start = time.perf_counter()
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.set_page_load_timeout(60)
+    driver.profile_warm = warm
+    print(f"🕒 Chrome起動 {time.perf_counter() - start:.2f}s（{'warm' if warm else 'cold'}）")
+    return driver
+
+
+def timed_get(driver, url, label="初回ページ読み込み"):
+    """driver.get の所要時間をプロファイルの warm/cold 付きで表示する"""
+    start = time.perf_counter()
+    driver.get(url)
+    warm = "warm" if getattr(driver, "profile_warm", False) else "cold"
+    print(f"🕒 {label} {time.perf_counter() - start:.2f}s（{warm}）")
+
+
+# ====== ログイン・デバッグ補助 ======
+DEBUG_DIR = Path(__file__).resolve().parents[1] / "debug"
+
+
+def inject_cookies(driver, cookies_path):
+    """トップページを開いて Cookie を注入する（ログイン再現）"""
+    path = Path(cookies_path)
+    if not path.exists():
+        print("⏭️ Cookieファイルが存在しません:", path)
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cookies = json.load(f)
+        timed_get(driver, "https://jp.mercari.com/")
+        time.sleep(1)
+        ok = 0
+        for c in cookies:
+            try:
+                # name/value/domain があればそのまま使える想定
+                driver.add_cookie(c)
+                ok += 1
+            except Exception:
+                pass
+        print(f"🍪 Cookie注入完了: {ok}件")
+    except Exception as e:
+        print("⚠️ Cookie読み込みエラー:", e)
+
+
+def restart_driver(driver, create_driver, cookies_path):
+    """ブラウザを作り直して Cookie を入れ直す"""
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    driver = create_driver()
+    inject_cookies(driver, cookies_path)
+    return driver
+
+
+def save_debug(driver, prefix, debug_dir=DEBUG_DIR):
+    """スクリーンショットと HTML を debug/ に保存する（Actions Artifact で確認）"""
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    png = Path(debug_dir) / f"{prefix}_{ts}.png"
+    html = Path(debug_dir) / f"{prefix}_{ts}.html"
+    try:
+        png.parent.mkdir(parents=True, exist_ok=True)
+        driver.save_screenshot(str(png))
+        with open(html, "w", encoding="utf-8") as f:
+            f.write(driver.page_source)
+        print(f"🧾 デバッグ保存: {png}, {html}")
+    except Exception as e:
+        print(f"デバッグ保存失敗: {e}")
+
+
+# ====== 適応タイムアウト ======
+# 待機箇所（site）ごとに待ち時間を記録し、次回以降のタイムアウトを
+# 「高パーセンタイル × 余裕 + 定数」にする（上限は従来の固定値、下限はその半分）。
+# タイムアウトした待機も「上限に達した」サンプルとして記録し、次に成功するまでその site は上限で待つ。
+# 送信後の反映確認のように短縮すると二重投稿につながる待機には使わないこと。
+# 記録は history/_timeouts.json に保存し（"_" 始まりは Parquet 読み込みで無視される）、
+# ワークフローのキャッシュで実行間に引き継ぐ。保存するのは save_on_exit() を呼んだスクリプトだけで、
+# 同時に動く他プロセスの記録を消さないよう、ロックを取ってディスク上の内容に今回分を足してから書き込む。
+TIMEOUT_STATS_PATH = Path(
+    os.environ.get("MERCARI_TIMEOUT_STATS", str(Path(__file__).resolve().parents[1] / "history" / "_timeouts.json"))
+)
+
+
+class TimeoutPolicy:
+    def __init__(self, path=TIMEOUT_STATS_PATH, percentile=0.95, factor=1.5, margin=0.5,
+                 floor_ratio=0.5, min_samples=20, keep=500):
+        self.path = Path(path)
+        self.percentile = percentile
+        self.factor = factor
+        self.margin = margin
+        self.floor_ratio = floor_ratio
+        self.min_samples = min_samples
+        self.keep = keep
+        self.enabled = os.environ.get("MERCARI_ADAPTIVE_TIMEOUT", "1") != "0"
+        self.learn = True       # replay など本番と条件が違う実行では False にする
+        self.samples = {}
+        self.added = {}         # この実行で増えたサンプル（保存時にディスク上の記録へ足す）
+        self.failures = {}
+        self.saved = {}
+        self.widened = set()    # 直近の待機が失敗した site（次に成功するまで上限で待つ）
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.samples = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self._save_registered = False
+
+    def timeout(self, site, ceiling):
+        samples = self.samples.get(site, [])
+        if not self.enabled or site in self.widened or len(samples) < self.min_samples:
+            return ceiling
+        ordered = sorted(samples)
+        high = ordered[int(self.percentile * (len(ordered) - 1))]
+        return min(ceiling, max(ceiling * self.floor_ratio, high * self.factor + self.margin))
+
+    def record(self, site, elapsed, ok, ceiling, limit):
+        with self._lock:
+            if not ok:
+                self.failures[site] = self.failures.get(site, 0) + 1
+                self.saved[site] = self.saved.get(site, 0.0) + (ceiling - limit)
+                self.widened.add(site)
+                elapsed = max(elapsed, limit)  # 打ち切られた待機は上限値のサンプルとして残す
+            else:
+                self.widened.discard(site)
+            if self.learn:
+                sample = round(elapsed, 3)
+                samples = self.samples.setdefault(site, [])
+                samples.append(sample)
+                del samples[:-self.keep]
+                self.added.setdefault(site, []).append(sample)
+
+    def call(self, site, ceiling, fn):
+        """fn(timeout) を学習済みタイムアウトで実行する（偽値 or TimeoutException は失敗として記録）"""
+        limit = self.timeout(site, ceiling)
+        start = time.perf_counter()
+        try:
+            result = fn(limit)
+        except Exception as e:
+            if type(e).__name__ == "TimeoutException" and ceiling > 0:
+                self.record(site, time.perf_counter() - start, False, ceiling, limit)
+            raise
+        if ceiling > 0:
+            self.record(site, time.perf_counter() - start, bool(result), ceiling, limit)
+        return result
+
+    def save_on_exit(self):
+        """終了時に今回の記録を保存する（待機時間を学習するスクリプトだけが呼ぶ）"""
+        if not self._save_registered:
+            self._save_registered = True
+            atexit.register(self.save)
+
+    def save(self):
+        import fcntl
+
+        with self._lock:
+            added = {site: list(values) for site, values in self.added.items() if values}
+        if not self.learn or not added:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        merged = json.load(f)
+                except (OSError, ValueError):
+                    merged = {}
+                for site, values in added.items():
+                    merged[site] = (merged.get(site, []) + values)[-self.keep:]
+                fd, tmp = tempfile.mkstemp(prefix=self.path.name, dir=self.path.parent)
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(merged, f)
+                    os.replace(tmp, self.path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+            with self._lock:
+                self.added = {}
+        except OSError as e:
+            print(f"⚠️ タイムアウト統計の保存失敗: {e}")
+
+    def report(self):
+        for site in sorted(set(self.samples) | set(self.failures)):
+            n = len(self.samples.get(site, []))
+            print(
+                f"⏲️ {site}: サンプル {n}件 / 失敗 {self.failures.get(site, 0)}件 / "
+                f"失敗時の短縮 {self.saved.get(site, 0.0):.1f}s"
+            )
+        print(f"⏲️ 失敗時の待機短縮 合計: {sum(self.saved.values()):.1f}s")
+
+
+TIMEOUTS = TimeoutPolicy()
+
+
+def adaptive_timeout(site):
+    """timeout 引数（渡された値か既定値 = 上限）を TIMEOUTS の学習値に差し替えるデコレータ"""
+    def decorator(fn):
+        sig = inspect.signature(fn)
+        default = sig.parameters["timeout"].default
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            ceiling = bound.arguments.get("timeout", default)
+
+            def run(limit):
+                bound.arguments["timeout"] = limit
+                return fn(*bound.args, **bound.kwargs)
+
+            return TIMEOUTS.call(site, ceiling, run)
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+メルカリ 出品履歴ストア（Parquet / pandas）
+- 出品取得スクリプトが毎回の item_data を history/account=<アカウント>/date=<日付>/ に追記
+- 分析はすべて pandas のベクトル演算（Sheets から作り直さない）
+    python scripts/mercari_history.py --account men --days 7
+"""
+
+import argparse
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from mercari_common import MIN_PRICE, PRICE_STEP
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+HISTORY_DIR = Path(os.environ.get("MERCARI_HISTORY_DIR", str(REPO_ROOT / "history")))
+
+
+# ====== 書き込み ======
+def append_snapshot(item_data, account, when=None):
+    """[商品名, 価格, URL] のリストを 1 スナップショットとして保存する（空なら保存しない）"""
+    if not item_data:
+        # 取得失敗の空スナップショットを残すと sell_through で全件「消えた」扱いになる
+        print(f"⚠️ 取得件数 0 件のため履歴を保存しません（{account}）")
+        return None
+    when = when or datetime.now()
+    df = pd.DataFrame(item_data, columns=["name", "price", "url"])
+    df["price"] = pd.to_numeric(df["price"].astype(str).str.replace(r"[^\d]", "", regex=True), errors="coerce")
+    df["price"] = df["price"].astype("Int64")
+    df["captured_at"] = pd.Timestamp(when)
+
+    part_dir = HISTORY_DIR / f"account={account}" / f"date={when:%Y-%m-%d}"
+    part_dir.mkdir(parents=True, exist_ok=True)
+    path = part_dir / f"part-{when:%H%M%S}.parquet"
+    df.to_parquet(path, index=False)
+    print(f"🗂️ 履歴保存: {path}（{len(df)}件）")
+    return path
+
+
+# ====== 読み込み ======
+def load_history(account=None):
+    """全スナップショット（account / date 列付き）。1 日に複数回あれば最後の取得を採用"""
+    if not HISTORY_DIR.exists():
+        return pd.DataFrame(columns=["name", "price", "url", "captured_at", "account", "date"])
+    filters = [("account", "=", account)] if account else None
+    df = pd.read_parquet(HISTORY_DIR, filters=filters)
+    df["account"] = df["account"].astype(str)
+    df["date"] = pd.to_datetime(df["date"].astype(str))
+    df = df.sort_values("captured_at").drop_duplicates(["account", "date", "url"], keep="last")
+    return df.sort_values(["account", "url", "date"]).reset_index(drop=True)
+
+
+# ====== 分析 ======
+def unchanged_items(df, days):
+    """最新スナップショットに残っていて、価格が days 日以上変わっていない商品（価格不明の行は据え置き扱いしない）"""
+    if df.empty:
+        return df.assign(since=pd.NaT, days_unchanged=0)
+    # 価格が読めなかった（<NA>）日は比較結果も NA になるので「変わった」とみなして起点を切り直す
+    price_changed = df["price"].ne(df["price"].shift()).fillna(True).astype(bool)
+    new_item = (df["account"] != df["account"].shift()) | (df["url"] != df["url"].shift())
+    df = df.assign(since=df["date"].where(new_item | price_changed).ffill())
+    latest_date = df.groupby("account")["date"].transform("max")
+    latest = df[(df["date"] == latest_date) & df["price"].notna()]
+    latest = latest.assign(days_unchanged=(latest["date"] - latest["since"]).dt.days)
+    return latest[latest["days_unchanged"] >= days].reset_index(drop=True)
+
+
+def price_drop_candidates(df, days, step=PRICE_STEP, min_price=MIN_PRICE):
+    """値下げ候補（unchanged_items のうち値下げ後も最低価格以上のもの）と新価格・編集 URL"""
+    items = unchanged_items(df, days)
+    items = items.assign(new_price=items["price"] - step)
+    items = items[items["new_price"] >= min_price]
+    return items.assign(edit_url=items["url"].str.replace("/item/", "/sell/edit/", regex=False))
+
+
+def sell_through(df):
+    """
+    スナップショット間で一覧から消えた割合（売れた or 削除）をアカウント・日付ごとに返す。
+    取得日はアカウントごとに違うので、比較はそのアカウントの次の取得日とだけ行う。
+    """
+    if df.empty:
+        return pd.DataFrame(columns=["account", "date", "listed", "gone", "rate"])
+    frames = []
+    for account, part in df.groupby("account"):
+        presence = pd.crosstab(part["url"], part["date"]).gt(0)
+        listed = presence.iloc[:, :-1]
+        gone = listed & ~presence.iloc[:, 1:].to_numpy()
+        frames.append(pd.DataFrame({"account": account, "listed": listed.sum(), "gone": gone.sum()}))
+    out = pd.concat(frames).rename_axis("date").reset_index()
+    out["rate"] = (out["gone"] / out["listed"]).round(3)
+    return out[["account", "date", "listed", "gone", "rate"]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--account", help="men / ladies（未指定なら全アカウント）")
+    parser.add_argument("--days", type=int, default=7, help="価格据え置き日数のしきい値")
+    args = parser.parse_args()
+
+    df = load_history(args.account)
+    print(f"✅ 履歴: {len(df)}行 / {df['date'].nunique()}日分")
+    print(f"\n📌 {args.days}日以上価格据え置き")
+    print(unchanged_items(df, args.days)[["account", "name", "price", "since", "days_unchanged"]].to_string())
+    print("\n💴 値下げ候補")
+    print(price_drop_candidates(df, args.days)[["account", "name", "price", "new_price", "edit_url"]].to_string())
+    print("\n📉 消化率（次回取得までに一覧から消えた割合）")
+    print(sell_through(df).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
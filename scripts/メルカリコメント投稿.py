@@ -7,18 +7,9 @@
 
 import os
 import time
-import json
-import random
-import datetime
-import tempfile
-import shutil
-import atexit
 import traceback
 from pathlib import Path
 
-import gspread
-from google.oauth2.service_account import Credentials
-from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
@@ -26,152 +17,212 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 
+from mercari_common import (
+    DEFAULT_TEMPLATES, STATUS_DONE, STATUS_DRY_RUN, STATUS_FAIL, STATUS_SKIP, STATUS_UNVERIFIED, CircuitBreaker,
+    MemoryController, PhaseTimer, RateLimiter, ResultWriter, Throttled, driver_profile, in_shard, inject_cookies,
+    insert_text, launch_chrome, load_page, load_replay_rows, load_templates, page_state, parse_run_args,
+    print_retry_summary, render_comment, restart_driver, save_debug, shard_label, start_background, startup_timer,
+    unavailable_reason, with_retry,
+)
+
 
 # ====== パス・設定 ======
 REPO_ROOT = Path(__file__).resolve().parents[1]
-DEBUG_DIR = REPO_ROOT / "debug"
-DEBUG_DIR.mkdir(parents=True, exist_ok=True)
-
 COOKIES_PATH = os.environ.get("MERCARI_COOKIES_PATH", str(REPO_ROOT / "mercari_cookies.json"))
 SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1E0XCjvoEriGnBU8dhMro0bC464JJ5hOmiIZUrZoQal8/edit"
 TARGET_SHEET = "メルカリコメント投稿"
+TEMPLATE_SHEET = "メルカリコメントテンプレート"
 
 
 # ====== Chrome起動 ======
-def create_driver():
+def create_driver(profile_dir=None):
     chrome_options = Options()
 
     # ==== ヘッドレス設定（ここでON/OFFを切り替える）====
   
     chrome_options.add_argument("--headless=chrome")  # 必要に応じて外してOK（OFF）
 
-    # 一時プロファイルで競合防止
-    tmp_profile = tempfile.mkdtemp(prefix="mercari_profile_")
+    # 一時プロファイルで競合防止（ウォーム済みテンプレートを複製、終了時に削除）
+    tmp_profile, warm = driver_profile(profile_dir, build_driver=create_driver)
     chrome_options.add_argument(f"--user-data-dir={tmp_profile}")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
 
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.set_page_load_timeout(60)
-
-    # 終了時に一時プロファイル削除
-    def cleanup():
-        shutil.rmtree(tmp_profile, ignore_errors=True)
-    atexit.register(cleanup)
-
-    return driver
-
-
-# ====== Cookie注入 ======
-def inject_cookies(driver):
-    path = Path(COOKIES_PATH)
-    if not path.exists():
-        print("⏭️ Cookieファイルが存在しません:", path)
-        return
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            cookies = json.load(f)
-        driver.get("https://jp.mercari.com/")
-        time.sleep(1)
-        count = 0
-        for c in cookies:
-            try:
-                driver.add_cookie(c)
-                count += 1
-            except Exception:
-                pass
-        print(f"🍪 Cookie注入完了: {count}件")
-    except Exception as e:
-        print("⚠️ Cookie読み込みエラー:", e)
+    return launch_chrome(chrome_options, warm)
 
 
 # ====== Google Sheets ======
 def load_sheet_rows():
+    # gspread / google-auth は Sheets を使う時だけ読み込む（起動短縮）
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "service_account.json")
     scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     creds = Credentials.from_service_account_file(cred_path, scopes=scope)
     client = gspread.authorize(creds)
-    ws = client.open_by_url(SPREADSHEET_URL).worksheet(TARGET_SHEET)
-    data = ws.get_all_values()
-    return ws, data
-
-
-# ====== デバッグ保存 ======
-def save_debug(driver, prefix):
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    png = DEBUG_DIR / f"{prefix}_{ts}.png"
-    html = DEBUG_DIR / f"{prefix}_{ts}.html"
-    try:
-        driver.save_screenshot(str(png))
-        with open(html, "w", encoding="utf-8") as f:
-            f.write(driver.page_source)
-        print(f"🧾 デバッグ保存: {png}, {html}")
-    except Exception as e:
-        print(f"デバッグ保存失敗: {e}")
+    spreadsheet = with_retry("open_by_url", client.open_by_url, SPREADSHEET_URL)
+    ws = with_retry("worksheet", spreadsheet.worksheet, TARGET_SHEET)
+    data = with_retry("get_all_values", ws.get_all_values)
+    return ws, data, load_templates(spreadsheet, TEMPLATE_SHEET)
 
 
 # ====== コメント投稿メイン処理 ======
 def main():
-    driver = create_driver()
+    startup = startup_timer()
+    args = parse_run_args()
+    # Google 認証〜シート読込は Chrome 起動・Cookie 注入と並行して進めておく
+    sheets = None if args.replay else start_background("Sheets読込", load_sheet_rows)
+    memory = MemoryController()  # 予算は自分の Chrome を起動する前の空きメモリで決める
+    with startup.phase("chrome"):
+        driver = create_driver()
+    breaker = CircuitBreaker()
+    limiter = RateLimiter.for_shard(args.shard)
+    run_timer = PhaseTimer()
     wait = WebDriverWait(driver, 15)
 
-    inject_cookies(driver)
-    driver.get("https://jp.mercari.com/")
-    time.sleep(1)
+    if args.replay:
+        # 保存済みページから再生（シート・ログイン不要）
+        ws, templates = None, dict(DEFAULT_TEMPLATES)
+        rows = [["商品名", "価格", "URL", "コメント"]] + load_replay_rows(args.replay)
+        print(f"🧪 replay: {args.replay} → {len(rows) - 1} 行")
+    else:
+        with startup.phase("cookies"):
+            inject_cookies(driver, COOKIES_PATH)
+            driver.get("https://jp.mercari.com/")
+            time.sleep(1)
+
+        with startup.phase("sheets_wait"):
+            ws, rows, templates = sheets.result()
+        print("✅ スプレッドシート読込完了:", len(rows), "行")
+    print(f"🚀 起動内訳: {startup.summary()}")
+    if args.dry_run:
+        print("🧪 dry-run: 送信ボタンはクリックしません")
+
+    header = rows[0] if rows else []
+    status_col = header.index("ステータス") + 1 if "ステータス" in header else 5  # E列デフォルト
+    # dry-run はシートに書き込まない
+    results = ResultWriter(None if args.dry_run else ws, status_col, "men" + shard_label(args.shard))
+    if args.shard[1] > 1:
+        mine = sum(1 for row in rows[1:] if len(row) > 2 and in_shard(row[2], args.shard))
+        print(f"🧩 shard {args.shard[0]}/{args.shard[1]}: {mine}/{len(rows) - 1} 行を担当")
 
-    ws, rows = load_sheet_rows()
-    print("✅ スプレッドシート読込完了:", len(rows), "行")
-
-    for idx, row in enumerate(rows[1:], start=2):
+    try:
+        for idx, row in enumerate(rows[1:], start=2):
+            timer = None
+            try:
+                url = row[2] if len(row) > 2 else ""
+                cell = row[3] if len(row) > 3 else ""
+
+                if not url or not cell.strip():
+                    print(f"Row {idx}: URLまたはコメントが空のためスキップ")
+                    continue
+                if not in_shard(url, args.shard):
+                    continue
+                if len(row) >= status_col and row[status_col - 1] == STATUS_DONE:
+                    print(f"Row {idx}: ⏭️ 投稿済みのためスキップ")
+                    continue
+                try:
+                    comment = render_comment(cell, templates, row[0], row[1])
+                except ValueError as e:
+                    print(f"Row {idx}: ❌ {e}")
+                    results.record(idx, STATUS_FAIL, "テンプレート不明")
+                    continue
+
+                # メモリ逼迫時はブラウザを作り直して RSS をリセット
+                memory.sample("men", driver)
+                if memory.should_restart():
+                    print(f"Row {idx}: 🧠 メモリ逼迫 → ブラウザ再起動")
+                    driver = restart_driver(driver, create_driver, COOKIES_PATH)
+
+                timer = PhaseTimer()
+                print(f"\nRow {idx}: アクセス → {url}")
+                with timer.phase("load"):
+                    loaded = load_page(driver, url, breaker)
+                if not loaded:
+                    print(f"Row {idx}: ⚠️ 商品ページ読み込み失敗")
+                    save_debug(driver, f"load_timeout_row{idx}")
+                    results.record(idx, STATUS_FAIL, "読み込み失敗")
+                    continue
+                time.sleep(3)
+
+                with timer.phase("textarea"):
+                    state = page_state(driver)
+                    reason = unavailable_reason(state)
+                    for attempt in range(3):
+                        if state["textarea"] or reason:
+                            break
+                        driver.execute_script("window.scrollBy(0, 500);")
+                        time.sleep(1)
+                        state = page_state(driver)
+                    textarea = state["textarea"]
+
+                if reason:
+                    print(f"Row {idx}: ⏭️ {reason}のためスキップ")
+                    results.record(idx, STATUS_SKIP, reason)
+                    continue
+                if not textarea:
+                    print(f"Row {idx}: ❌ コメント欄が見つかりません")
+                    save_debug(driver, f"no_textarea_row{idx}")
+                    results.record(idx, STATUS_FAIL, "コメント欄なし")
+                    continue
+
+                textarea.click()
+                textarea.clear()
+                with timer.phase("input"):
+                    how = insert_text(driver, textarea, comment)
+                print(f"Row {idx}: コメント入力完了（{how}）")
+
+                # 送信ボタン
+                with timer.phase("submit"):
+                    buttons = driver.find_elements(By.XPATH, "//button[contains(text(),'コメント')]")
+                    button = next((b for b in buttons if b.is_displayed()), None)
+
+                # 送信間隔（レート制限）
+                if button and not args.replay:
+                    waited = limiter.wait()
+                    if waited > 0:
+                        print(f"Row {idx}: ⏳ {waited:.1f} 秒待機")
+
+                if button and args.dry_run:
+                    print(f"Row {idx}: 🧪 dry-run（送信せず）")
+                    results.record(idx, STATUS_DRY_RUN)
+                elif button:
+                    with timer.phase("submit"):
+                        driver.execute_script("arguments[0].click();", button)
+                    print("🚀 コメント送信クリック")
+                    # 反映は確認していないので「完了」にはしない（再実行時に対象に残る）
+                    results.record(idx, STATUS_UNVERIFIED, "反映未確認")
+                else:
+                    print("⚠️ 送信ボタンが見つかりません")
+                    results.record(idx, STATUS_FAIL, "送信ボタンなし")
+            except Throttled as e:
+                # 規制中は行を失敗にせず中断（未処理の行は次回実行で拾う）
+                print(f"Row {idx}: ⛔ {e} → 処理を中断")
+                break
+            except Exception as e:
+                print(f"Row {idx}: エラー発生: {e}")
+                save_debug(driver, f"error_row{idx}")
+                results.record(idx, STATUS_FAIL, "例外")
+            finally:
+                if timer:
+                    print(f"Row {idx}: ⏱ {timer.summary()}")
+                    run_timer.merge(timer)
+
+        print("✅ 全処理完了")
+        print(f"⏱ フェーズ合計: {run_timer.summary()}")
+        memory.report()
+        print_retry_summary()
+    finally:
+        # 途中で落ちても処理済みの行は書き戻す
+        results.flush()
+        results.write_summary()
         try:
-            url = row[2] if len(row) > 2 else ""
-            comment = row[3] if len(row) > 3 else ""
-
-            if not url or not comment.strip():
-                print(f"Row {idx}: URLまたはコメントが空のためスキップ")
-                continue
-
-            driver.get(url)
-            print(f"\nRow {idx}: アクセス → {url}")
-            time.sleep(3)
-
-            textarea = None
-            for attempt in range(3):
-                elems = driver.find_elements(By.TAG_NAME, "textarea")
-                textarea = next((e for e in elems if e.is_displayed()), None)
-                if textarea:
-                    break
-                driver.execute_script("window.scrollBy(0, 500);")
-                time.sleep(1)
-
-            if not textarea:
-                print(f"Row {idx}: ❌ コメント欄が見つかりません")
-                save_debug(driver, f"no_textarea_row{idx}")
-                continue
-
-            textarea.click()
-            textarea.clear()
-            textarea.send_keys(comment)
-            print(f"Row {idx}: コメント入力完了")
-
-            # 送信ボタン
-            buttons = driver.find_elements(By.XPATH, "//button[contains(text(),'コメント')]")
-            button = next((b for b in buttons if b.is_displayed()), None)
-            if button:
-                driver.execute_script("arguments[0].click();", button)
-                print("🚀 コメント送信クリック")
-            else:
-                print("⚠️ 送信ボタンが見つかりません")
-
-            time.sleep(random.uniform(2.5, 4.0))
-        except Exception as e:
-            print(f"Row {idx}: エラー発生: {e}")
-            save_debug(driver, f"error_row{idx}")
-
-    driver.quit()
-    print("✅ 全処理完了")
+            driver.quit()
+        except Exception:
+            pass
 
 
 if __name__ == "__main__":
@@ -1,22 +1,17 @@
 #     python "scripts/メルカリレディス.py"
 # -*- coding: utf-8 -*-
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException
+# selenium / gspread / google-auth / pandas は使う関数の中で import する
+# （Sheets 接続をバックグラウンドで先に始めてから重いモジュールを読み込む）
 import time
-import jpholiday
 from datetime import datetime
 import os
-import gspread
-from google.oauth2.service_account import Credentials
 import re
-import tempfile
-import shutil
-import atexit
+
+from mercari_common import (
+    TEMPLATE_HEADER, TIMEOUTS, collect_items_incremental, driver_profile, launch_chrome, print_retry_summary,
+    start_background, startup_timer, template_key_for, template_rows, timed_get, with_retry,
+)
 
 # ====== 設定 ======
 PROFILE_URL = "https://jp.mercari.com/user/profile/515867944"  # ★レディース
@@ -24,10 +19,14 @@ SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1E0XCjvoEriGnBU8dhMro0
 
 SHEET_MAIN_NAME   = "メルカリ出品2"          # 商品名, 価格, URL
 SHEET_EDIT_NAME   = "メルカリ100円値下げ2"   # 商品名, 価格, 編集URL
-SHEET_CM_NAME     = "メルカリコメント投稿2"   # 商品名, 価格, URL, コメント
+SHEET_CM_NAME     = "メルカリコメント投稿2"   # 商品名, 価格, URL, テンプレートキー
+SHEET_TPL_NAME    = "メルカリコメントテンプレート2"  # キー, コメント（本文はここに1回だけ保存）
+HISTORY_ACCOUNT   = "ladies"    # history/account=... の名前
 
 # ====== ドライバ作成（テンポラリプロフィールで競合回避）======
-def create_driver():
+def create_driver(profile_dir=None):
+    from selenium.webdriver.chrome.options import Options
+
     chrome_options = Options()
 
     # === ヘッドレス（ON / OFF はこの1行をコメントアウトで切替）===
@@ -40,36 +39,25 @@ def create_driver():
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
 
-    # 一時プロファイルを使う（毎回ユニーク）
-    tmp_profile = tempfile.mkdtemp(prefix="mercari_profile_")
+    # 一時プロファイルで競合防止（ウォーム済みテンプレートを複製、終了時に削除）
+    tmp_profile, warm = driver_profile(profile_dir, build_driver=create_driver)
     chrome_options.add_argument(f"--user-data-dir={tmp_profile}")
     chrome_options.add_argument("--no-first-run")
     chrome_options.add_argument("--no-default-browser-check")
 
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.set_page_load_timeout(60)
-
-    # 後始末
-    def _cleanup():
-        try:
-            driver.quit()
-        except Exception:
-            pass
-        try:
-            shutil.rmtree(tmp_profile, ignore_errors=True)
-        except Exception:
-            pass
-
-    atexit.register(_cleanup)
-    return driver
+    return launch_chrome(chrome_options, warm)
 
 # ====== 安定クリック ======
 def safe_click(driver, by, value, retries=3):
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import StaleElementReferenceException
+
     for i in range(retries):
         try:
-            element = WebDriverWait(driver, 30).until(
+            element = TIMEOUTS.call("safe_click", 30, lambda t: WebDriverWait(driver, t).until(
                 EC.element_to_be_clickable((by, value))
-            )
+            ))
             element.click()
             return
         except StaleElementReferenceException:
@@ -79,6 +67,9 @@ def safe_click(driver, by, value, retries=3):
 
 # ====== Google スプレッドシート ======
 def open_spreadsheet():
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "service_account.json")
     scope = [
         "https://spreadsheets.google.com/feeds",
@@ -87,35 +78,41 @@ def open_spreadsheet():
     ]
     credentials = Credentials.from_service_account_file(cred_path, scopes=scope)
     client = gspread.authorize(credentials)
-    return client.open_by_url(SPREADSHEET_URL)
+    return with_retry("open_by_url", client.open_by_url, SPREADSHEET_URL)
 
 def update_or_create_sheet(spreadsheet, sheet_name, header, rows):
+    import gspread
+
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        worksheet.clear()
+        worksheet = with_retry("worksheet", spreadsheet.worksheet, sheet_name)
+        with_retry("clear", worksheet.clear)
     except gspread.exceptions.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows="1000", cols="10")
-    worksheet.update('A1', [header] + rows)
-
-# ====== メイン ======
-def main():
-    driver = create_driver()
-    wait = WebDriverWait(driver, 30)
+        worksheet = with_retry("add_worksheet", spreadsheet.add_worksheet, title=sheet_name, rows="1000", cols="10")
+    with_retry("update", worksheet.update, 'A1', [header] + rows)
 
-    # 1. プロフィールにアクセス
-    driver.get(PROFILE_URL)
+def ensure_template_sheet(spreadsheet, sheet_name):
+    # テンプレートは既存シートがあれば手編集を尊重してそのまま使う
+    import gspread
 
-    # 検索入力欄（ページ内検索）を一度クリック
     try:
-        safe_click(driver, By.XPATH, '//*[@id="main"]/div[3]/label/input')
-        time.sleep(1.5)
-    except Exception:
+        with_retry("worksheet", spreadsheet.worksheet, sheet_name)
+        return
+    except gspread.exceptions.WorksheetNotFound:
         pass
+    worksheet = with_retry("add_worksheet", spreadsheet.add_worksheet, title=sheet_name, rows="20", cols="2")
+    with_retry("update", worksheet.update, 'A1', [TEMPLATE_HEADER] + template_rows())
+    print(f"📝 テンプレートシート作成: {sheet_name}")
+
+# ====== 商品一覧（全件読み込み後に一括取得）======
+def scrape_items_full(driver, wait):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
 
     # 「もっと見る」を可能な限り押す
     more_xpath = '//button[text()="もっと見る"]'
     while True:
         try:
+            # タイムアウト = 一覧の終端なので、ここは学習で短縮せず固定 30 秒で待つ
             more = wait.until(EC.element_to_be_clickable((By.XPATH, more_xpath)))
             more.click()
             driver.execute_script("window.scrollBy(0, 400);")
@@ -158,10 +155,64 @@ def main():
             print(f"❌ 商品取得失敗: {e}")
             continue
 
+    return item_data
+
+# ====== 商品一覧（ブラウザ）======
+def scrape_items_browser():
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver = create_driver()
+    wait = WebDriverWait(driver, 30)
+
+    try:
+        # 1. プロフィールにアクセス
+        timed_get(driver, PROFILE_URL)
+
+        # 検索入力欄（ページ内検索）を一度クリック
+        try:
+            safe_click(driver, By.XPATH, '//*[@id="main"]/div[3]/label/input')
+            time.sleep(1.5)
+        except Exception:
+            pass
+
+        # 商品一覧の取得（MERCARI_SCRAPE_MODE=incremental で逐次取得モード）
+        if os.environ.get("MERCARI_SCRAPE_MODE") == "incremental":
+            hide = os.environ.get("MERCARI_SCRAPE_HIDE", "1") != "0"
+            item_data = collect_items_incremental(driver, hide=hide)
+        else:
+            item_data = scrape_items_full(driver, wait)
+    finally:
+        try:
+            driver.quit()
+        except Exception:
+            pass
+    return item_data
+
+# ====== メイン ======
+def main():
+    startup = startup_timer()
+    TIMEOUTS.save_on_exit()
+    # Google 認証〜open_by_url は取得処理と並行して進めておく
+    sheets = start_background("Sheets接続", open_spreadsheet)
+
+    with startup.phase("scrape"):
+        item_data = scrape_items_browser()
+
     print(f"✅ 取得件数: {len(item_data)} 件")
 
-    # 3. Google シート更新
-    spreadsheet = open_spreadsheet()
+    # 出品履歴（Parquet）に追記 ※失敗してもシート更新は続行
+    with startup.phase("history"):
+        try:
+            from mercari_history import append_snapshot
+            append_snapshot(item_data, HISTORY_ACCOUNT)
+        except Exception as e:
+            print(f"⚠️ 履歴保存失敗: {e}")
+
+    # 3. Google シート更新（バックグラウンドの接続完了を待つ）
+    with startup.phase("sheets_wait"):
+        spreadsheet = sheets.result()
+    print(f"🚀 起動内訳: {startup.summary()}")
 
     header_main = ['商品名', '価格', 'URL']
     update_or_create_sheet(spreadsheet, SHEET_MAIN_NAME, header_main, item_data)
@@ -172,31 +223,17 @@ def main():
         rows_edit.append([name, price, edit_url])
     update_or_create_sheet(spreadsheet, SHEET_EDIT_NAME, header_main, rows_edit)
 
-    # コメント文面
-    today = datetime.now()
-    weekday = today.strftime('%A')
-    is_holiday = jpholiday.is_holiday(today)
-    is_weekend = weekday in ['Saturday', 'Sunday']
-    comment = (
-        "☆★土日祝限定SALE★☆\n" if is_weekend or is_holiday else "☆★本日限定SALE★☆\n"
-    )
-    comment += (
-        "こちらの商品ご検討頂き\nありがとうございます♫本日に限り\n"
-        "『ご希望の価格』を承ります！あまりに大幅な場合はお断りすることがございますが、"
-        "できる限りご要望お応えしたいと思います！\n"
-        "早い者勝ちになりますのでコメント\nにて金額ご提示ください(^^)\n"
-    )
+    # コメント文面（本文はテンプレートシート、各行はキーのみ）
+    ensure_template_sheet(spreadsheet, SHEET_TPL_NAME)
+    template_key = template_key_for(datetime.now())
 
     header_comment = ['商品名', '価格', 'URL', 'コメント']
-    rows_comment = [[name, price, url, comment] for name, price, url in item_data]
+    rows_comment = [[name, price, url, template_key] for name, price, url in item_data]
     update_or_create_sheet(spreadsheet, SHEET_CM_NAME, header_comment, rows_comment)
 
     print("✅ スプレッドシートへのアップロード完了")
-
-    try:
-        driver.quit()
-    except Exception:
-        pass
+    print_retry_summary()
+    TIMEOUTS.report()
 
 if __name__ == "__main__":
     main()
@@ -10,46 +10,42 @@
 
 import os
 import time
-import json
-import random
-import datetime
-import tempfile
-import shutil
-import atexit
 import traceback
 from pathlib import Path
 
-import gspread
-from google.oauth2.service_account import Credentials
-from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 
+from mercari_common import (
+    DEFAULT_TEMPLATES, STATUS_DONE, STATUS_DRY_RUN, STATUS_FAIL, STATUS_SKIP, TIMEOUTS, CircuitBreaker,
+    MemoryController, PhaseTimer, RateLimiter, ResultWriter, Throttled, adaptive_timeout, driver_profile, in_shard,
+    inject_cookies, insert_text, launch_chrome, load_page, load_replay_rows, load_templates, page_state,
+    parse_run_args, print_retry_summary, render_comment, restart_driver, save_debug, shard_label, start_background,
+    startup_timer, unavailable_reason, with_retry,
+)
+
 
 # ====== パス・定数 ======
 REPO_ROOT = Path(__file__).resolve().parents[1]
-DEBUG_DIR = REPO_ROOT / "debug"
-DEBUG_DIR.mkdir(parents=True, exist_ok=True)
-
 COOKIES_PATH = os.environ.get("MERCARI_COOKIES_PATH", str(REPO_ROOT / "mercari_cookies.json"))
 SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1E0XCjvoEriGnBU8dhMro0bC464JJ5hOmiIZUrZoQal8/edit"
 TARGET_SHEET = "メルカリコメント投稿2"   # ★ レディース用シート名
+TEMPLATE_SHEET = "メルカリコメントテンプレート2"
 
 
 # ====== Chrome 起動 ======
-def create_driver():
+def create_driver(profile_dir=None):
     chrome_options = Options()
 
     # ==== ヘッドレス設定（ここでON/OFFを切り替える）====
     chrome_options.add_argument("--headless=chrome")  # 必要に応じて外してOK（ON）
     #chrome_options.add_argument("--headless=chrome")  # 必要に応じて外してOK（OFF）
 
-    # 一時プロファイルで競合防止
-    tmp_profile = tempfile.mkdtemp(prefix="mercari_profile_")
+    # 一時プロファイルで競合防止（ウォーム済みテンプレートを複製、終了時に削除）
+    tmp_profile, warm = driver_profile(profile_dir, build_driver=create_driver)
     chrome_options.add_argument(f"--user-data-dir={tmp_profile}")
     chrome_options.add_argument("--no-first-run")
     chrome_options.add_argument("--no-default-browser-check")
@@ -60,177 +56,81 @@ def create_driver():
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
 
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.set_page_load_timeout(60)
-
-    # 終了時に一時プロファイル削除
-    def cleanup():
-        shutil.rmtree(tmp_profile, ignore_errors=True)
-    atexit.register(cleanup)
-
-    return driver
-
-
-# ====== Cookie 注入（ログイン再現） ======
-def inject_cookies(driver):
-    path = Path(COOKIES_PATH)
-    if not path.exists():
-        print("⏭️ Cookieファイルが存在しません:", path)
-        return
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            cookies = json.load(f)
-        driver.get("https://jp.mercari.com/")
-        time.sleep(1)
-        ok = 0
-        for c in cookies:
-            try:
-                # name/value/domain があればそのまま使える想定
-                driver.add_cookie(c)
-                ok += 1
-            except Exception:
-                pass
-        print(f"🍪 Cookie注入完了: {ok}件")
-    except Exception as e:
-        print("⚠️ Cookie読み込みエラー:", e)
+    return launch_chrome(chrome_options, warm)
 
 
 # ====== Google Sheets ======
 def load_sheet_rows():
+    # gspread / google-auth は Sheets を使う時だけ読み込む（起動短縮）
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "service_account.json")
     scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     creds = Credentials.from_service_account_file(cred_path, scopes=scope)
     client = gspread.authorize(creds)
-    ws = client.open_by_url(SPREADSHEET_URL).worksheet(TARGET_SHEET)
-    rows = ws.get_all_values()
+    spreadsheet = with_retry("open_by_url", client.open_by_url, SPREADSHEET_URL)
+    ws = with_retry("worksheet", spreadsheet.worksheet, TARGET_SHEET)
+    rows = with_retry("get_all_values", ws.get_all_values)
     header = rows[0] if rows else []
     data = rows[1:] if len(rows) > 1 else []
     try:
         status_col = header.index("ステータス") + 1
     except ValueError:
         status_col = 5  # E列デフォルト
-    return ws, data, status_col
-
-
-def mark_fail(worksheet, sheet_row: int, status_col: int, reason: str = ""):
-    val = "失敗" + (f"（{reason}）" if reason else "")
-    try:
-        worksheet.update_cell(sheet_row, status_col, val)
-    except Exception as e:
-        print(f"⚠️ ステータス更新失敗: {e}")
-
-
-# ====== デバッグ保存 ======
-def save_debug(driver, prefix):
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    png = DEBUG_DIR / f"{prefix}_{ts}.png"
-    html = DEBUG_DIR / f"{prefix}_{ts}.html"
-    try:
-        driver.save_screenshot(str(png))
-        with open(html, "w", encoding="utf-8") as f:
-            f.write(driver.page_source)
-        print(f"🧾 デバッグ保存: {png}, {html}")
-    except Exception as e:
-        print(f"デバッグ保存失敗: {e}")
+    return ws, data, status_col, load_templates(spreadsheet, TEMPLATE_SHEET)
 
 
 # ====== UI ユーティリティ ======
-def expand_more_comments_if_any(driver):
-    try:
-        more = WebDriverWait(driver, 4).until(
-            EC.element_to_be_clickable((By.XPATH, "//button[normalize-space()='コメントをもっと見る']"))
-        )
-        driver.execute_script("arguments[0].click();", more)
-        print("👆『コメントをもっと見る』クリック済")
-        time.sleep(0.6)
-    except Exception:
-        print("⏭️ 『コメントをもっと見る』は無し")
-
-
-def get_comment_blocks(driver):
-    return driver.find_elements(
-        By.XPATH,
-        "//*[(@data-testid='comment' or contains(@class,'CommentItem') or contains(@class,'comment'))]"
-    )
-
-
-def get_comment_count(driver):
-    return len(get_comment_blocks(driver))
-
-
-def find_comment_textarea(driver):
-    candidates = [
-        (By.CSS_SELECTOR, "#item-info textarea"),
-        (By.CSS_SELECTOR, "form textarea"),
-        (By.XPATH, "//textarea[not(@disabled)]"),
-        (By.XPATH, "//textarea[contains(@placeholder,'コメント') or contains(@aria-label,'コメント')]"),
-    ]
-    for by, sel in candidates:
-        for el in driver.find_elements(by, sel):
-            try:
-                if el.is_displayed() and el.is_enabled():
-                    return el
-            except Exception:
-                continue
-    return None
-
-
-SUBMIT_XPATHS = [
-    "//form//button[@type='submit' and contains(normalize-space(),'コメントを送信')]",
-    "//button[@type='submit' and contains(normalize-space(),'コメント')]",
-    "//form//button[@type='submit']",
-]
+def expand_more_comments_if_any(driver, state, timeout=4):
+    """『コメントをもっと見る』があれば押して、押した後の状態を返す（ボタンは遅れて描画されるので timeout 秒まで待つ）"""
+    end = time.time() + timeout
+    while not state["expand"]:
+        if time.time() >= end:
+            print("⏭️ 『コメントをもっと見る』は無し")
+            return state
+        time.sleep(0.3)
+        state = page_state(driver)
+    driver.execute_script("arguments[0].click();", state["expand"])
+    print("👆『コメントをもっと見る』クリック済")
+    time.sleep(0.6)
+    return page_state(driver)
 
 
+@adaptive_timeout("submit_button")
 def find_submit_button(driver, timeout=10):
     end = time.time() + timeout
     while time.time() < end:
-        for xp in SUBMIT_XPATHS:
-            btns = driver.find_elements(By.XPATH, xp)
-            for b in btns:
-                try:
-                    if b.is_displayed() and b.is_enabled():
-                        return b
-                except Exception:
-                    continue
+        btn = page_state(driver)["submit"]
+        if btn:
+            return btn
         time.sleep(0.2)
     raise TimeoutException("送信ボタンが見つかりません")
 
 
 def verify_posted(driver, comment_text: str, before_count: int, timeout=18) -> bool:
     end = time.time() + timeout
-    seen_toast = False
     partial = comment_text.strip()[:20]
-    while time.time() < end:
-        if get_comment_count(driver) > before_count:
+    while True:
+        state = page_state(driver)
+        if state["comments"] > before_count:
+            return True
+        # トースト表示済みで textarea が空
+        if state["posted_marker"] and state["textareas_empty"]:
             return True
-        # トースト
-        for pat in ["コメントを送信", "コメントを投稿", "コメントを送信しました", "コメントを投稿しました"]:
-            if driver.find_elements(By.XPATH, f"//*[contains(normalize-space(), '{pat}')]"):
-                seen_toast = True
-        # textarea 空
-        tas = driver.find_elements(By.TAG_NAME, "textarea")
-        if tas and all((ta.get_attribute("value") or "").strip() == "" for ta in tas):
-            if seen_toast:
-                return True
         # 直近コメント一致
-        blocks = get_comment_blocks(driver)
-        if blocks:
-            last_txt = (blocks[-1].text or "").strip()
-            if partial and partial in last_txt:
-                return True
+        if partial and partial in state["last_comment"]:
+            return True
+        if time.time() >= end:
+            return False
         time.sleep(0.3)
-    return False
 
 
+@adaptive_timeout("item_loaded")
 def wait_item_loaded(driver, timeout=25) -> bool:
+    # 削除済みページは h1 が出ないことがあるので、削除表示も「読み込み完了」とみなす
     try:
-        WebDriverWait(driver, timeout).until(
-            EC.any_of(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "h1")),
-                EC.presence_of_element_located((By.CSS_SELECTOR, "#item-info textarea"))
-            )
-        )
+        WebDriverWait(driver, timeout).until(lambda d: page_state(d)["ready"])
         return True
     except TimeoutException:
         return False
@@ -238,55 +138,112 @@ def wait_item_loaded(driver, timeout=25) -> bool:
 
 # ====== メイン処理 ======
 def main():
-    driver = create_driver()
+    startup = startup_timer()
+    args = parse_run_args()
+    if args.replay:
+        TIMEOUTS.learn = False  # file:// の読み込み時間は本番の待機時間として学習しない
+    TIMEOUTS.save_on_exit()
+    # Google 認証〜シート読込は Chrome 起動・Cookie 注入と並行して進めておく
+    sheets = None if args.replay else start_background("Sheets読込", load_sheet_rows)
+    memory = MemoryController()  # 予算は自分の Chrome を起動する前の空きメモリで決める
+    with startup.phase("chrome"):
+        driver = create_driver()
+    breaker = CircuitBreaker()
+    limiter = RateLimiter.for_shard(args.shard)
+    run_timer = PhaseTimer()
+    results = None
     try:
         wait = WebDriverWait(driver, 15)
 
-        # Cookie 注入 → 軽くトップへ
-        inject_cookies(driver)
-        driver.get("https://jp.mercari.com/")
-        time.sleep(1)
-
-        worksheet, data, status_col = load_sheet_rows()
-        print("✅ スプレッドシート読込完了:", len(data), "行")
+        if args.replay:
+            # 保存済みページから再生（シート・ログイン不要）
+            worksheet, status_col, templates = None, 5, dict(DEFAULT_TEMPLATES)
+            data = load_replay_rows(args.replay)
+            print(f"🧪 replay: {args.replay} → {len(data)} 行")
+        else:
+            # Cookie 注入 → 軽くトップへ
+            with startup.phase("cookies"):
+                inject_cookies(driver, COOKIES_PATH)
+                driver.get("https://jp.mercari.com/")
+                time.sleep(1)
+
+            with startup.phase("sheets_wait"):
+                worksheet, data, status_col, templates = sheets.result()
+            print("✅ スプレッドシート読込完了:", len(data), "行")
+        print(f"🚀 起動内訳: {startup.summary()}")
+        if args.dry_run:
+            print("🧪 dry-run: 送信ボタンはクリックしません")
+        # dry-run はシートに書き込まない
+        results = ResultWriter(None if args.dry_run else worksheet, status_col, "ladies" + shard_label(args.shard))
+        if args.shard[1] > 1:
+            mine = sum(1 for row in data if len(row) > 2 and in_shard(row[2], args.shard))
+            print(f"🧩 shard {args.shard[0]}/{args.shard[1]}: {mine}/{len(data)} 行を担当")
 
         for idx, row in enumerate(data, start=2):  # シートの行番号
+            timer = None
             try:
                 url = row[2] if len(row) > 2 else ""
-                comment = row[3] if len(row) > 3 else ""
+                cell = row[3] if len(row) > 3 else ""
 
-                if not url or not comment.strip():
+                if not url or not cell.strip():
                     print(f"Row {idx}: URL/コメントが空のためスキップ")
                     continue
+                if not in_shard(url, args.shard):
+                    continue
+                if len(row) >= status_col and row[status_col - 1] == STATUS_DONE:
+                    print(f"Row {idx}: ⏭️ 投稿済みのためスキップ")
+                    continue
+                try:
+                    comment = render_comment(cell, templates, row[0], row[1])
+                except ValueError as e:
+                    print(f"Row {idx}: ❌ {e}")
+                    results.record(idx, STATUS_FAIL, "テンプレート不明")
+                    continue
 
-                driver.get(url)
-                print(f"\nRow {idx}: アクセス → {url}")
+                # メモリ逼迫時はブラウザを作り直して RSS をリセット
+                memory.sample("ladies", driver)
+                if memory.should_restart():
+                    print(f"Row {idx}: 🧠 メモリ逼迫 → ブラウザ再起動")
+                    driver = restart_driver(driver, create_driver, COOKIES_PATH)
+                    wait = WebDriverWait(driver, 15)
 
-                if not wait_item_loaded(driver, timeout=25):
+                timer = PhaseTimer()
+                print(f"\nRow {idx}: アクセス → {url}")
+                with timer.phase("load"):
+                    loaded = load_page(driver, url, breaker, ready=lambda d: wait_item_loaded(d, timeout=25))
+                if not loaded:
                     print(f"Row {idx}: ⚠️ 商品ページ読み込み失敗")
                     save_debug(driver, f"load_timeout_row{idx}")
-                    mark_fail(worksheet, idx, status_col, "読み込み失敗")
+                    results.record(idx, STATUS_FAIL, "読み込み失敗")
                     continue
 
-                expand_more_comments_if_any(driver)
+                with timer.phase("textarea"):
+                    state = page_state(driver)
+                    reason = unavailable_reason(state)
+                    if not reason:
+                        state = expand_more_comments_if_any(driver, state)
+                        # コメント欄探索
+                        for attempt in range(1, 4):
+                            if state["textarea"]:
+                                break
+                            print(f"Row {idx}: コメント欄検出失敗 {attempt}/3 → スクロール再試行")
+                            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                            time.sleep(0.8)
+                            state = page_state(driver)
+
+                if reason:
+                    print(f"Row {idx}: ⏭️ {reason}のためスキップ")
+                    results.record(idx, STATUS_SKIP, reason)
+                    continue
 
                 # 投稿前の件数
-                before = get_comment_count(driver)
-
-                # コメント欄探索
-                area = None
-                for attempt in range(1, 4):
-                    area = find_comment_textarea(driver)
-                    if area:
-                        break
-                    print(f"Row {idx}: コメント欄検出失敗 {attempt}/3 → スクロール再試行")
-                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(0.8)
-
+                before = state["comments"]
+                area = state["textarea"]
                 if not area:
-                    print(f"Row {idx}: ❌ コメント欄未検出")
+                    why = "コメント欄なし" if state["logged_in"] else "未ログイン"
+                    print(f"Row {idx}: ❌ コメント欄未検出（{why}）")
                     save_debug(driver, f"no_textarea_row{idx}")
-                    mark_fail(worksheet, idx, status_col, "コメント欄なし")
+                    results.record(idx, STATUS_FAIL, why)
                     continue
 
                 driver.execute_script("arguments[0].scrollIntoView({block:'center'});", area)
@@ -300,86 +257,109 @@ def main():
                     area.clear()
                 except Exception:
                     pass
-                area.send_keys(comment)
-                driver.execute_script("arguments[0].dispatchEvent(new Event('input', {bubbles:true}));", area)
-                print("📝 コメント入力完了")
+                with timer.phase("input"):
+                    how = insert_text(driver, area, comment)
+                print(f"📝 コメント入力完了（{how}） ⏱ input={timer.phases['input']:.2f}s")
 
                 # 送信ボタン
                 try:
-                    btn = find_submit_button(driver, timeout=10)
+                    with timer.phase("submit"):
+                        btn = find_submit_button(driver, timeout=10)
                 except TimeoutException:
                     print(f"Row {idx}: ❌ 送信ボタン未検出")
                     save_debug(driver, f"no_submit_row{idx}")
-                    mark_fail(worksheet, idx, status_col, "送信ボタンなし")
+                    results.record(idx, STATUS_FAIL, "送信ボタンなし")
+                    continue
+
+                if args.dry_run:
+                    # 送信はせず、反映確認の判定処理を 1 周だけ通して計測する
+                    with timer.phase("verify"):
+                        verify_posted(driver, comment_text=comment, before_count=before, timeout=0)
+                    print(f"Row {idx}: 🧪 dry-run（送信せず）")
+                    results.record(idx, STATUS_DRY_RUN)
+                    if not args.replay:
+                        limiter.wait()
                     continue
 
-                driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
-                time.sleep(0.2)
-                clicked = False
-                for how in ("js", "native", "actions"):
-                    try:
-                        if how == "js":
-                            driver.execute_script("arguments[0].click();", btn)
-                        elif how == "native":
-                            btn.click()
-                        else:
-                            ActionChains(driver).move_to_element(btn).pause(0.05).click().perform()
-                        print("🚀 送信ボタンをクリック")
-                        clicked = True
-                        break
-                    except Exception as e:
-                        print(f"送信クリック失敗({how}): {e}")
-                        time.sleep(0.2)
+                # 送信間隔（レート制限）
+                waited = limiter.wait()
+                if waited > 0:
+                    print(f"Row {idx}: ⏳ {waited:.1f} 秒待機")
+
+                with timer.phase("submit"):
+                    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
+                    time.sleep(0.2)
+                    clicked = False
+                    for how in ("js", "native", "actions"):
+                        try:
+                            if how == "js":
+                                driver.execute_script("arguments[0].click();", btn)
+                            elif how == "native":
+                                btn.click()
+                            else:
+                                ActionChains(driver).move_to_element(btn).pause(0.05).click().perform()
+                            print("🚀 送信ボタンをクリック")
+                            clicked = True
+                            break
+                        except Exception as e:
+                            print(f"送信クリック失敗({how}): {e}")
+                            time.sleep(0.2)
 
                 if not clicked:
                     print(f"Row {idx}: ❌ 送信クリックに失敗")
                     save_debug(driver, f"post_clickfail_row{idx}")
-                    mark_fail(worksheet, idx, status_col, "クリック失敗")
+                    results.record(idx, STATUS_FAIL, "クリック失敗")
                     continue
 
                 # 反映確認
-                ok = verify_posted(driver, comment_text=comment, before_count=before, timeout=18)
+                with timer.phase("verify"):
+                    ok = verify_posted(driver, comment_text=comment, before_count=before, timeout=18)
                 if ok:
                     print(f"Row {idx}: ✅ 投稿完了（反映確認済）")
-                    # 成功時も記録したければ↓
-                    # worksheet.update_cell(idx, status_col, "完了")
+                    results.record(idx, STATUS_DONE, latency=timer.phases["verify"])
                 else:
                     print(f"Row {idx}: ❌ 投稿失敗（反映確認できず）")
                     save_debug(driver, f"post_fail_row{idx}")
-                    mark_fail(worksheet, idx, status_col, "反映確認できず")
-
-                # クールダウン
-                wt = random.uniform(2.5, 4.0)
-                time.sleep(wt)
-                print(f"Row {idx}: ⏳ {wt:.1f} 秒待機")
+                    results.record(idx, STATUS_FAIL, "反映確認できず", latency=timer.phases["verify"])
 
+            except Throttled as e:
+                # 規制中は行を失敗にせず中断（未処理の行は次回実行で拾う）
+                print(f"Row {idx}: ⛔ {e} → 処理を中断")
+                break
             except TimeoutException as te:
                 print(f"Row {idx}: Timeout → {te}")
                 save_debug(driver, f"timeout_row{idx}")
-                mark_fail(worksheet, idx, status_col, "Timeout")
+                results.record(idx, STATUS_FAIL, "Timeout")
                 continue
             except WebDriverException as we:
                 print(f"Row {idx}: WebDriver例外 → {we}")
                 save_debug(driver, f"webdriver_row{idx}")
-                mark_fail(worksheet, idx, status_col, "WebDriver")
+                results.record(idx, STATUS_FAIL, "WebDriver")
                 # 再起動で継続
-                try:
-                    driver.quit()
-                except Exception:
-                    pass
-                driver = create_driver()
-                inject_cookies(driver)
+                driver = restart_driver(driver, create_driver, COOKIES_PATH)
                 wait = WebDriverWait(driver, 15)
                 continue
             except Exception as e:
                 print(f"Row {idx}: 予期せぬ例外 → {e}\n{traceback.format_exc()}")
                 save_debug(driver, f"unexpected_row{idx}")
-                mark_fail(worksheet, idx, status_col, "例外")
+                results.record(idx, STATUS_FAIL, "例外")
                 continue
+            finally:
+                if timer:
+                    print(f"Row {idx}: ⏱ {timer.summary()}")
+                    run_timer.merge(timer)
 
         print("✅ 全コメント投稿処理 完了")
+        print(f"⏱ フェーズ合計: {run_timer.summary()}")
+        memory.report()
+        print_retry_summary()
+        TIMEOUTS.report()
 
     finally:
+        # 途中で落ちても処理済みの行は書き戻す
+        if results:
+            results.flush()
+            results.write_summary()
         try:
             driver.quit()
         except Exception:
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+メルカリ 100円値下げ 実行スクリプト（GitHub Actions対応）
+- 出品取得スクリプトが作る「メルカリ100円値下げ(2)」シートの編集URLを順に開いて値下げ
+- 複数のログイン済みブラウザ（ワーカー）で並列実行、送信間隔はコメント投稿と同じレート制限
+- 保存後に編集ページを開き直して価格を確認、結果は終了時にまとめてシートへ書き戻す
+    python "scripts/メルカリ値下げ実行.py" --account men [--dry-run] [--shard 1/3]
+"""
+
+import argparse
+import os
+import re
+import sys
+import queue
+import threading
+import traceback
+from pathlib import Path
+
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from mercari_common import (
+    MIN_PRICE, PRICE_STEP, STATUS_DONE, STATUS_DRY_RUN, STATUS_FAIL, STATUS_SKIP, TIMEOUTS, CircuitBreaker,
+    MemoryController, PhaseTimer, RateLimiter, ResultWriter, Throttled, adaptive_timeout, driver_profile,
+    ensure_profile_template, in_shard, inject_cookies, insert_text, launch_chrome, load_page, parse_run_args,
+    print_retry_summary, restart_driver, run_arg_parser, save_debug, shard_label, start_background, startup_timer,
+    with_retry,
+)
+
+
+# ====== パス・定数 ======
+REPO_ROOT = Path(__file__).resolve().parents[1]
+COOKIES_PATH = os.environ.get("MERCARI_COOKIES_PATH", str(REPO_ROOT / "mercari_cookies.json"))
+SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1E0XCjvoEriGnBU8dhMro0bC464JJ5hOmiIZUrZoQal8/edit"
+EDIT_SHEETS = {
+    "men": "メルカリ100円値下げ",
+    "ladies": "メルカリ100円値下げ2",
+}
+PRICE_INPUT_SELECTORS = [
+    (By.CSS_SELECTOR, "input[name='price']"),
+    (By.XPATH, "//input[@inputmode='numeric' or @type='number']"),
+]
+SAVE_XPATH = "//button[contains(normalize-space(),'変更する')]"
+
+
+# ====== Chrome 起動 ======
+def create_driver(profile_dir=None):
+    chrome_options = Options()
+
+    # ==== ヘッドレス設定（ここでON/OFFを切り替える）====
+    chrome_options.add_argument("--headless=chrome")  # 必要に応じて外してOK（ON）
+
+    # 一時プロファイルで競合防止（テンプレート作成はワーカー起動前に main で 1 回だけ）
+    tmp_profile, warm = driver_profile(profile_dir)
+    chrome_options.add_argument(f"--user-data-dir={tmp_profile}")
+    chrome_options.add_argument("--no-first-run")
+    chrome_options.add_argument("--no-default-browser-check")
+
+    # CI 安定化
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+
+    return launch_chrome(chrome_options, warm)
+
+
+# ====== Google Sheets ======
+def load_sheet_rows(sheet_name):
+    # gspread / google-auth は Sheets を使う時だけ読み込む（起動短縮）
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "service_account.json")
+    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+    creds = Credentials.from_service_account_file(cred_path, scopes=scope)
+    client = gspread.authorize(creds)
+    spreadsheet = with_retry("open_by_url", client.open_by_url, SPREADSHEET_URL)
+    ws = with_retry("worksheet", spreadsheet.worksheet, sheet_name)
+    rows = with_retry("get_all_values", ws.get_all_values)
+    header = rows[0] if rows else []
+    data = rows[1:] if len(rows) > 1 else []
+    status_col = header.index("ステータス") + 1 if "ステータス" in header else 4  # D列デフォルト
+    return ws, data, status_col
+
+
+# ====== UI ユーティリティ ======
+def parse_price(text):
+    digits = re.sub(r"[^\d]", "", text or "")
+    return int(digits) if digits else None
+
+
+def find_price_input(driver):
+    for by, sel in PRICE_INPUT_SELECTORS:
+        for el in driver.find_elements(by, sel):
+            try:
+                if el.is_displayed() and el.is_enabled():
+                    return el
+            except Exception:
+                continue
+    return None
+
+
+@adaptive_timeout("edit_loaded")
+def wait_edit_loaded(driver, timeout=25) -> bool:
+    try:
+        WebDriverWait(driver, timeout).until(lambda d: find_price_input(d) is not None)
+        return True
+    except TimeoutException:
+        return False
+
+
+def verify_price(driver, edit_url, expected, timeout=15) -> bool:
+    # 保存後は編集ページから遷移するので、それを待ってから開き直して確認
+    try:
+        WebDriverWait(driver, timeout).until(lambda d: "/sell/edit/" not in d.current_url)
+    except TimeoutException:
+        pass
+    driver.get(edit_url)
+    if not wait_edit_loaded(driver, timeout=timeout):
+        return False
+    el = find_price_input(driver)
+    return el is not None and parse_price(el.get_attribute("value")) == expected
+
+
+# ====== 値下げ（1 件） ======
+class PriceEditRun:
+    """ワーカー間で共有する設定と状態"""
+
+    def __init__(self, args, results):
+        self.args = args
+        self.results = results
+        self.step = args.step
+        self.breaker = CircuitBreaker()
+        self.limiter = RateLimiter.for_shard(args.shard)
+        self.memory = MemoryController()
+        self.run_timer = PhaseTimer()
+        self.dead_workers = []  # Chrome の起動・再起動に失敗して止まったワーカー
+        self._lock = threading.Lock()
+
+    def merge_timer(self, timer):
+        with self._lock:
+            self.run_timer.merge(timer)
+
+
+def edit_price(driver, worker, idx, row, run):
+    name = row[0] if len(row) > 0 else ""
+    base = parse_price(row[1] if len(row) > 1 else "")
+    edit_url = row[2] if len(row) > 2 else ""
+    tag = f"[{worker}] Row {idx}"
+    if not edit_url or "/sell/edit/" not in edit_url or base is None:
+        print(f"{tag}: 編集URL/価格が空のためスキップ")
+        return
+
+    # シート上の価格（出品取得時点）で先に最低価格を判定し、ページを開かずに済ませる
+    target = base - run.step
+    if target < MIN_PRICE:
+        print(f"{tag}: ⏭️ 最低価格 {MIN_PRICE}円 を下回るためスキップ")
+        run.results.record(idx, STATUS_SKIP, "最低価格")
+        return
+
+    timer = PhaseTimer()
+    try:
+        print(f"\n{tag}: アクセス → {edit_url}（{name} {base}円 → {target}円）")
+        with timer.phase("load"):
+            loaded = load_page(driver, edit_url, run.breaker, ready=wait_edit_loaded)
+        if not loaded:
+            print(f"{tag}: ⚠️ 編集ページ読み込み失敗")
+            save_debug(driver, f"price_load_row{idx}")
+            run.results.record(idx, STATUS_FAIL, "読み込み失敗")
+            return
+
+        el = find_price_input(driver)
+        current = parse_price(el.get_attribute("value"))
+        if current is None:
+            print(f"{tag}: ❌ 現在の価格を読み取れません")
+            save_debug(driver, f"price_read_row{idx}")
+            run.results.record(idx, STATUS_FAIL, "価格読み取り失敗")
+            return
+        if current == target:
+            # 前回の実行で値下げ済み（ステータス書き戻し前に落ちた場合など）
+            print(f"{tag}: ✅ 値下げ済み（現在 {current}円）")
+            run.results.record(idx, STATUS_DONE, "変更済み")
+            return
+        if current != base:
+            # シート取得後に手動で価格が変わっている → シートの価格から計算すると値下げ幅がずれるので触らない
+            print(f"{tag}: ⏭️ 現在 {current}円 がシートの {base}円 と異なるためスキップ")
+            run.results.record(idx, STATUS_SKIP, "価格不一致")
+            return
+        # ここでは current == base なので、値下げ幅は常に現在価格から step 円
+        target = current - run.step
+
+        with timer.phase("input"):
+            el.send_keys(Keys.CONTROL, "a")
+            el.send_keys(Keys.DELETE)
+            insert_text(driver, el, str(target))
+
+        if run.args.dry_run:
+            print(f"{tag}: 🧪 dry-run（保存せず）")
+            run.results.record(idx, STATUS_DRY_RUN)
+            return
+
+        # 送信間隔（レート制限）
+        waited = run.limiter.wait()
+        if waited > 0:
+            print(f"{tag}: ⏳ {waited:.1f} 秒待機")
+
+        with timer.phase("save"):
+            btn = TIMEOUTS.call("save_button", 10, lambda t: WebDriverWait(driver, t).until(
+                EC.element_to_be_clickable((By.XPATH, SAVE_XPATH))
+            ))
+            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
+            driver.execute_script("arguments[0].click();", btn)
+
+        with timer.phase("verify"):
+            ok = verify_price(driver, edit_url, target)
+        if ok:
+            print(f"{tag}: ✅ 値下げ完了（{target}円 確認済）")
+            run.results.record(idx, STATUS_DONE, latency=timer.phases["verify"])
+        else:
+            print(f"{tag}: ❌ 値下げ失敗（価格確認できず）")
+            save_debug(driver, f"price_verify_row{idx}")
+            run.results.record(idx, STATUS_FAIL, "価格確認できず", latency=timer.phases["verify"])
+    finally:
+        print(f"{tag}: ⏱ {timer.summary()}")
+        run.merge_timer(timer)
+
+
+# ====== ワーカー ======
+def worker_loop(worker, jobs, run):
+    driver = None
+    try:
+        driver = create_driver()
+        inject_cookies(driver, COOKIES_PATH)
+        while True:
+            try:
+                idx, row = jobs.get_nowait()
+            except queue.Empty:
+                return
+
+            # メモリ逼迫時はこのワーカーのブラウザを作り直す
+            run.memory.sample(worker, driver)
+            if run.memory.should_restart(worker):
+                print(f"[{worker}] 🧠 メモリ逼迫 → ブラウザ再起動")
+                driver = restart_driver(driver, create_driver, COOKIES_PATH)
+
+            try:
+                edit_price(driver, worker, idx, row, run)
+            except Throttled as e:
+                # 規制中は行を失敗にせずこのワーカーを止める（未処理の行は次回実行で拾う）
+                print(f"[{worker}] Row {idx}: ⛔ {e} → ワーカー停止")
+                return
+            except TimeoutException as te:
+                print(f"[{worker}] Row {idx}: Timeout → {te}")
+                save_debug(driver, f"price_timeout_row{idx}")
+                run.results.record(idx, STATUS_FAIL, "Timeout")
+            except WebDriverException as we:
+                print(f"[{worker}] Row {idx}: WebDriver例外 → {we}")
+                save_debug(driver, f"price_webdriver_row{idx}")
+                run.results.record(idx, STATUS_FAIL, "WebDriver")
+                driver = restart_driver(driver, create_driver, COOKIES_PATH)
+            except Exception as e:
+                print(f"[{worker}] Row {idx}: 予期せぬ例外 → {e}\n{traceback.format_exc()}")
+                save_debug(driver, f"price_unexpected_row{idx}")
+                run.results.record(idx, STATUS_FAIL, "例外")
+    except Exception as e:
+        # 行の外（Chrome 起動・再起動）で失敗。未処理の行はキューに残り、他のワーカーか main が処理する
+        print(f"[{worker}] ❌ ブラウザ起動失敗 → ワーカー停止: {e}\n{traceback.format_exc()}")
+        with run._lock:
+            run.dead_workers.append(worker)
+    finally:
+        run.memory.forget(worker)
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+# ====== メイン処理 ======
+def int_arg(minimum, env):
+    """minimum 以上の整数を受け付ける argparse の type"""
+    def parse(text):
+        try:
+            value = int(text)
+        except (TypeError, ValueError):
+            value = None
+        if value is None or value < minimum:
+            raise argparse.ArgumentTypeError(f"{minimum} 以上の整数で指定（{env}）: {text!r}")
+        return value
+    return parse
+
+
+def main():
+    startup = startup_timer()
+    parser = run_arg_parser(replay=False)  # 編集ページの replay 再生は未対応
+    parser.add_argument(
+        "--account", choices=sorted(EDIT_SHEETS), default=os.environ.get("MERCARI_ACCOUNT", "men"),
+        help="対象アカウント（MERCARI_ACCOUNT でも可）",
+    )
+    # 文字列の既定値にも type が適用されるので、不正な環境変数も usage エラーになる
+    parser.add_argument(
+        "--step", type=int_arg(1, "MERCARI_PRICE_STEP"), default=os.environ.get("MERCARI_PRICE_STEP", str(PRICE_STEP)),
+        help="値下げ幅（円、MERCARI_PRICE_STEP でも可）",
+    )
+    parser.add_argument(
+        "--workers", type=int_arg(0, "MERCARI_PRICE_WORKERS"), default=os.environ.get("MERCARI_PRICE_WORKERS", "0"),
+        help="ブラウザワーカー数（0 ならメモリ予算から自動決定、MERCARI_PRICE_WORKERS でも可）",
+    )
+    args = parse_run_args(parser=parser)
+    TIMEOUTS.save_on_exit()
+
+    # シート読込とテンプレートプロファイル作成（Chrome 起動）を並行して進める
+    sheets = start_background("Sheets読込", load_sheet_rows, EDIT_SHEETS[args.account])
+    with startup.phase("template"):
+        ensure_profile_template(create_driver)
+    with startup.phase("sheets_wait"):
+        worksheet, data, status_col = sheets.result()
+    print("✅ スプレッドシート読込完了:", len(data), "行")
+    print(f"🚀 起動内訳: {startup.summary()}")
+    if args.dry_run:
+        print("🧪 dry-run: 保存ボタンはクリックしません")
+
+    # dry-run はシートに書き込まない
+    label = f"price-{args.account}" + shard_label(args.shard)
+    results = ResultWriter(None if args.dry_run else worksheet, status_col, label)
+    run = PriceEditRun(args, results)
+
+    jobs = queue.Queue()
+    for idx, row in enumerate(data, start=2):  # シートの行番号
+        if len(row) >= status_col and row[status_col - 1] == STATUS_DONE:
+            continue
+        if not in_shard(row[2] if len(row) > 2 else "", args.shard):
+            continue
+        jobs.put((idx, row))
+    if jobs.empty():
+        print("⏭️ 値下げ対象なし")
+        return 0
+
+    workers = min(args.workers or run.memory.worker_count(), jobs.qsize())
+    print(f"👷 ワーカー数: {workers}（対象 {jobs.qsize()} 件{shard_label(args.shard)}、値下げ幅 {run.step}円）")
+
+    threads = [
+        threading.Thread(target=worker_loop, args=(f"w{i + 1}", jobs, run), daemon=True)
+        for i in range(workers)
+    ]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if run.dead_workers:
+            # 全ワーカーが落ちると行がキューに残る → 失敗として記録して次回実行で拾う
+            left = 0
+            while not jobs.empty():
+                idx, _ = jobs.get_nowait()
+                results.record(idx, STATUS_FAIL, "ワーカー起動失敗")
+                left += 1
+            print(f"❌ ワーカー {len(run.dead_workers)}/{workers} 台が起動失敗（未処理 {left}件）")
+            return 1
+        print("✅ 全値下げ処理 完了")
+        return 0
+    finally:
+        # 途中で落ちても処理済みの行は書き戻す
+        results.flush()
+        results.write_summary()
+        print(f"⏱ フェーズ合計: {run.run_timer.summary()}")
+        run.memory.report()
+        print_retry_summary()
+        TIMEOUTS.report()
+
+
+if __name__ == "__main__":
+    sys.exit(main())